@@ -10,22 +10,29 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
+# Deployment profile: "development" (default) or "production", selected
+# with DJANGO_ENV. See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
+
+PRODUCTION = os.environ.get('DJANGO_ENV', 'development') == 'production'
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-ch6mt5=jg%$!q@0=iiguv#w-m9w=z%2am+(t^2#lks2g$b-*r!'
+if PRODUCTION:
+    SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+else:
+    SECRET_KEY = 'django-insecure-ch6mt5=jg%$!q@0=iiguv#w-m9w=z%2am+(t^2#lks2g$b-*r!'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# With DEBUG on, Django also keeps every executed SQL statement in memory.
+DEBUG = not PRODUCTION
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = os.environ['DJANGO_HOST'].split(',') if PRODUCTION else []
 
 
 # Application definition
@@ -45,6 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.timing.ServerTimingMiddleware',
+    'core.profiling.ProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,11 +94,28 @@ DATABASES = {
         'NAME': 'neslter',
         'USER': 'neslter',
         'PASSWORD': 'neslter',
-        'HOST': 'postgres',  # <-- IMPORTANT: same name as docker-compose service!
-        'PORT': '5432',
+        'HOST': os.environ.get('DJANGO_DB_HOST', 'postgres'),  # <-- IMPORTANT: same name as docker-compose service!
+        'PORT': os.environ.get('DJANGO_DB_PORT', '5432'),
     }
 }
 
+# In production, connections come from a psycopg connection pool shared by
+# the threads of each worker process instead of being opened per request.
+# Connections are checked before being handed out.
+# https://docs.djangoproject.com/en/5.1/ref/databases/#connection-pool
+
+if PRODUCTION:
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DJANGO_DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DJANGO_DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.environ.get('DJANGO_DB_POOL_TIMEOUT', 10)),
+            'check': ConnectionPool.check_connection,
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -126,6 +153,123 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+#
+# LocMemCache evicts the least recently used entry once MAX_ENTRIES is
+# reached. Point these at a shared backend (e.g. Redis) when running more
+# than one worker process so that version bumps are seen by every worker.
+#
+# Version markers (see core/caching.py) and station snapshots expire after
+# CACHE_VERSION_TTL seconds, which bounds how long a process-local cache can
+# miss writes made by other processes; 0 keeps them until the next write.
+
+CACHE_VERSION_TTL = int(os.environ.get('DJANGO_CACHE_VERSION_TTL', 300)) or None
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        'TIMEOUT': None,
+    },
+    'stations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stations',
+        'TIMEOUT': CACHE_VERSION_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'ctd': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ctd',
+        'TIMEOUT': int(os.environ.get('DJANGO_CTD_CACHE_TIMEOUT', 86400)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('DJANGO_CTD_CACHE_MAX_ENTRIES', 5000)),
+            'CULL_FREQUENCY': int(os.environ.get('DJANGO_CTD_CACHE_CULL_FREQUENCY', 3)),
+        },
+    },
+}
+
+# In production every alias lives in Redis, shared by all gunicorn workers;
+# gunicorn.conf.py refuses to start several workers on process-local caches
+
+if PRODUCTION:
+    REDIS_URL = os.environ.get('DJANGO_REDIS_URL', 'redis://redis:6379/0')
+    CACHES = {
+        alias: {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'TIMEOUT': cache['TIMEOUT'],
+            'KEY_PREFIX': alias,
+        }
+        for alias, cache in CACHES.items()
+    }
+
+STATION_SNAPSHOT_CACHE = 'stations'
+
+# Response cache for the CTD cruise, cast and niskin read endpoints (see
+# ctd/cache.py); None disables it
+
+CTD_RESPONSE_CACHE = 'ctd'
+
+# Seconds a cruise/cast name -> id mapping is trusted by this process (see
+# ctd/resolver.py); renames and deletes made here evict it at once
+
+CTD_NAME_RESOLVER_TTL = 300
+
+# In-process nearest-station index (see stations/index.py). Writes made in
+# this process invalidate it immediately; the TTL bounds how long writes
+# made by other worker processes can go unseen. /stations/add_nearest/npz
+# always uses the index; this enables it for the other nearest lookups.
+
+STATION_INDEX_ENABLED = False
+
+STATION_INDEX_TTL = 300
+
+# Number of points resolved per query when /stations/add_nearest streams
+# its response
+
+ADD_NEAREST_CHUNK_SIZE = 10000
+
+# Worker processes used by the station index for batches larger than
+# ADD_NEAREST_PARALLEL_CHUNK_SIZE points (0 or 1 runs them inline)
+
+ADD_NEAREST_WORKERS = 0
+
+ADD_NEAREST_PARALLEL_CHUNK_SIZE = 250000
+
+# Per-request SQL and timing instrumentation: Server-Timing headers and a
+# JSON line per request on the "api.timing" logger (see core/timing.py)
+
+REQUEST_TIMING_ENABLED = os.environ.get('DJANGO_REQUEST_TIMING', '') == '1'
+
+# Prometheus metrics at /metrics (see core/metrics.py)
+
+METRICS_ENABLED = True
+
+# Where requests profiled with "X-Profile: store" are written (see
+# core/profiling.py)
+
+PROFILE_DIR = os.environ.get('DJANGO_PROFILE_DIR', BASE_DIR / 'profiles')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -1,7 +1,14 @@
 from ninja import Router
 
+from .db import pool_stats
+
 router = Router()
 
 @router.get("/")
 def core_root(request):
     return {"message": "Welcome to the core API"}
+
+
+@router.get("/db/pool")
+def db_pool(request):
+    return pool_stats() or {"message": "Connection pooling is not enabled"}
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import profiling, timing
+
+        connection_created.connect(profiling.install_query_hook, dispatch_uid='request_profiling')
+        if timing.is_enabled():
+            connection_created.connect(timing.install_query_hook, dispatch_uid='request_timing')
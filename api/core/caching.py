@@ -0,0 +1,96 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Version markers for cached data, one per resource family (e.g. "stations").
+# A marker is the time of the last write in nanoseconds rather than a counter:
+# if it is missing from the cache (never written, or evicted) it is recreated
+# with the current time, which can only invalidate entries, never resurrect
+# stale ones. Markers live in the default cache unless a caller keeps its
+# own in another alias, and should be shared by all worker processes in
+# production.
+#
+# Markers expire after CACHE_VERSION_TTL seconds. With a process-local cache
+# a write only bumps the marker of the process that made it, so the TTL
+# bounds how long other processes keep serving (and validating) the data
+# from before the write.
+
+def _version_key(family):
+    return 'version:{}'.format(family)
+
+
+def _ttl():
+    return getattr(settings, 'CACHE_VERSION_TTL', None)
+
+
+def get_version(family):
+    cache = caches['default']
+    version = cache.get(_version_key(family))
+    if version is None:
+        cache.add(_version_key(family), time.time_ns(), timeout=_ttl())
+        version = cache.get(_version_key(family))
+    return version
+
+
+async def aget_version(family):
+    cache = caches['default']
+    version = await cache.aget(_version_key(family))
+    if version is None:
+        await cache.aadd(_version_key(family), time.time_ns(), timeout=_ttl())
+        version = await cache.aget(_version_key(family))
+    return version
+
+
+def get_versions(families, alias='default'):
+    # get_version() for several families in one cache round trip
+    cache = caches[alias]
+    keys = [_version_key(family) for family in families]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=_ttl())
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(families, alias='default'):
+    cache = caches[alias]
+    keys = [_version_key(family) for family in families]
+    versions = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, time.time_ns(), timeout=_ttl())
+        versions.update(await cache.aget_many(missing))
+    return [versions[key] for key in keys]
+
+
+def bump_version(family, alias='default'):
+    caches[alias].set(_version_key(family), time.time_ns(), timeout=_ttl())
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else None,
+        }
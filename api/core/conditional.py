@@ -0,0 +1,37 @@
+from typing import NamedTuple
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+# Conditional GET support for read endpoints backed by a version marker
+# (see core/caching.py). Validators are derived from the marker alone, so
+# a request answered with 304 never reaches the ORM or the serializers.
+
+class Validators(NamedTuple):
+    etag: str
+    last_modified: int  # seconds since the epoch
+
+
+def validators(family, version, *parts, last_modified=None):
+    etag = quote_etag('-'.join(str(part) for part in (family, version) + parts))
+    if last_modified is None:
+        last_modified = version // 1_000_000_000
+    return Validators(etag=etag, last_modified=int(last_modified))
+
+
+def set_headers(response, validators):
+    response['ETag'] = validators.etag
+    response['Last-Modified'] = http_date(validators.last_modified)
+
+
+def conditional_response(request, response, validators):
+    # Sets the validators on the temporal response and returns a 304 when
+    # the request's If-None-Match/If-Modified-Since match (412 for a failed
+    # If-Match), otherwise None
+    set_headers(response, validators)
+    conditional = get_conditional_response(
+        request, etag=validators.etag, last_modified=validators.last_modified)
+    if conditional is not None:
+        set_headers(conditional, validators)
+    return conditional
@@ -0,0 +1,18 @@
+from django.db import connections
+
+
+def pool_stats(alias='default'):
+    # Usage counters of the psycopg connection pool behind a database alias,
+    # or None when the alias is not configured with a pool
+    connection = connections[alias]
+    if not connection.settings_dict.get('OPTIONS', {}).get('pool'):
+        return None
+    stats = connection.pool.get_stats()
+    return {
+        'size': stats.get('pool_size', 0),
+        'in_use': stats.get('pool_size', 0) - stats.get('pool_available', 0),
+        'available': stats.get('pool_available', 0),
+        'waiting': stats.get('requests_waiting', 0),
+        'created': stats.get('connections_num', 0),
+        'max_size': stats.get('pool_max', 0),
+    }
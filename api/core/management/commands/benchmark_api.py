@@ -0,0 +1,176 @@
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Station, StationLocation, Vessel, Cruise, Cast, Niskin
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure latency, throughput and SQL query counts of the station and CTD '
+        'endpoints in-process, against whatever the database currently holds '
+        '(see generate_benchmark_data), and write the results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                            help='Points per /stations/add_nearest request')
+        parser.add_argument('--only', nargs='+', help='Run only scenarios whose name starts with one of these')
+        parser.add_argument('--clear-caches', action='store_true',
+                            help='Clear every configured cache before each request')
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if not StationLocation.objects.exists() or not Cast.objects.exists():
+            raise CommandError('Nothing to benchmark; run generate_benchmark_data first')
+
+        self.client = Client(HTTP_HOST=options['host'])
+        self.options = options
+        rng = random.Random(options['seed'])
+
+        results = []
+        for name, method, make_request in self._scenarios(rng):
+            if options['only'] and not any(name.startswith(prefix) for prefix in options['only']):
+                continue
+            result = self._measure(name, method, make_request)
+            results.append(result)
+            self.stderr.write('{:<40} p50 {:>9.2f} ms  p95 {:>9.2f} ms  {:>8.1f} req/s  {:>5.1f} queries'.format(
+                name, result['latency_ms']['p50'], result['latency_ms']['p95'],
+                result['throughput_rps'], result['queries']['mean']))
+
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'options': {key: options[key] for key in ('requests', 'warmup', 'batch_sizes', 'clear_caches', 'seed')},
+            'settings': {
+                'STATION_INDEX_ENABLED': getattr(settings, 'STATION_INDEX_ENABLED', False),
+                'CTD_RESPONSE_CACHE': getattr(settings, 'CTD_RESPONSE_CACHE', None),
+                'ADD_NEAREST_WORKERS': getattr(settings, 'ADD_NEAREST_WORKERS', 0),
+            },
+            'dataset': {
+                'stations': Station.objects.count(),
+                'station_locations': StationLocation.objects.count(),
+                'vessels': Vessel.objects.count(),
+                'cruises': Cruise.objects.count(),
+                'casts': Cast.objects.count(),
+                'niskins': Niskin.objects.count(),
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def _scenarios(self, rng):
+        # (name, method, function returning (path, JSON body or None)) for
+        # every endpoint and batch size measured
+        extent = StationLocation.objects.aggregate(start=Min('start_time'), end=Max('end_time'))
+        start = extent['start']
+        span = ((extent['end'] or timezone.now()) - start).total_seconds()
+
+        def random_time():
+            return start + timedelta(seconds=rng.uniform(0, span))
+
+        def random_point():
+            return rng.uniform(39.5, 41.5), rng.uniform(-71.5, -70.0)
+
+        cruises = list(Cruise.objects.values_list('name', flat=True))
+        casts = list(Cast.objects.values_list('cruise__name', 'number'))
+        niskins = list(Niskin.objects.values_list('cast__cruise__name', 'cast__number', 'number')[:10000])
+
+        yield 'stations/now', 'GET', lambda: ('/api/stations/now', None)
+        yield 'stations/at', 'GET', lambda: ('/api/stations/at/{}'.format(random_time().isoformat()), None)
+
+        def nearest():
+            latitude, longitude = random_point()
+            return '/api/stations/nearest', {
+                'latitude': latitude, 'longitude': longitude, 'timestamp': random_time().isoformat()}
+        yield 'stations/nearest', 'POST', nearest
+
+        for size in self.options['batch_sizes']:
+            def add_nearest(size=size):
+                points = [random_point() for _ in range(size)]
+                return '/api/stations/add_nearest', {
+                    'latitude': [latitude for latitude, _ in points],
+                    'longitude': [longitude for _, longitude in points],
+                    'timestamp': [random_time().isoformat() for _ in range(size)],
+                }
+            yield 'stations/add_nearest[{}]'.format(size), 'POST', add_nearest
+
+        yield 'ctd/vessels/get/all', 'GET', lambda: ('/api/ctd/vessels/get/all', None)
+        yield 'ctd/cruises/get/all', 'GET', lambda: ('/api/ctd/cruises/get/all', None)
+        yield 'ctd/cruises/get/{cruise_id}', 'GET', lambda: (
+            '/api/ctd/cruises/get/{}'.format(rng.choice(cruises)), None)
+        yield 'ctd/casts/get/{cruise_name}', 'GET', lambda: (
+            '/api/ctd/casts/get/{}'.format(rng.choice(cruises)), None)
+        yield 'ctd/cast/get/{cruise_name}/{cast_number}', 'GET', lambda: (
+            '/api/ctd/cast/get/{}/{}'.format(*rng.choice(casts)), None)
+        yield 'ctd/niskins/get/all/{cruise_name}/{cast_number}', 'GET', lambda: (
+            '/api/ctd/niskins/get/all/{}/{}'.format(*rng.choice(casts)), None)
+        if niskins:
+            yield 'ctd/niskins/get/{cruise_name}/{cast_number}/{niskin_number}', 'GET', lambda: (
+                '/api/ctd/niskins/get/{}/{}/{}'.format(*rng.choice(niskins)), None)
+
+    def _request(self, method, path, body):
+        if method == 'GET':
+            return self.client.get(path)
+        return self.client.post(path, data=json.dumps(body), content_type='application/json')
+
+    def _measure(self, name, method, make_request):
+        requests = [make_request() for _ in range(self.options['warmup'] + self.options['requests'])]
+        for path, body in requests[:self.options['warmup']]:
+            self._request(method, path, body)
+
+        latencies, queries, sizes, errors = [], [], [], 0
+        total = 0.0
+        for path, body in requests[self.options['warmup']:]:
+            if self.options['clear_caches']:
+                for alias in settings.CACHES:
+                    caches[alias].clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = self._request(method, path, body)
+                elapsed = time.perf_counter() - started
+            total += elapsed
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured.captured_queries))
+            sizes.append(len(response.content))
+            if response.status_code >= 400:
+                errors += 1
+
+        latencies.sort()
+        return {
+            'name': name,
+            'method': method,
+            'requests': len(latencies),
+            'errors': errors,
+            'latency_ms': {
+                'mean': statistics.fmean(latencies),
+                'p50': statistics.median(latencies),
+                'p95': latencies[int(0.95 * (len(latencies) - 1))],
+                'max': latencies[-1],
+            },
+            'throughput_rps': len(latencies) / total if total else None,
+            'queries': {'mean': statistics.fmean(queries), 'max': max(queries)},
+            'response_bytes': {'mean': statistics.fmean(sizes), 'max': max(sizes)},
+        }
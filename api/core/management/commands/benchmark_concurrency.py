@@ -0,0 +1,77 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Hold many concurrent slow-client connections against a running server '
+        'and report throughput and latency. Run it once against a WSGI server and '
+        'once against an ASGI server to compare the sync and async read paths.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://localhost:8000/api/stations/now')
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=5, help='Requests per client')
+        parser.add_argument('--client-delay', type=float, default=0.5,
+                            help='Seconds each client takes to send its request')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        latencies, errors = asyncio.run(self._run(options))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write('url          {}'.format(options['url']))
+        self.stdout.write('clients      {}'.format(options['clients']))
+        self.stdout.write('completed    {}'.format(len(latencies)))
+        self.stdout.write('errors       {}'.format(errors))
+        self.stdout.write('elapsed      {:.2f} s'.format(elapsed))
+        self.stdout.write('throughput   {:.1f} req/s'.format(len(latencies) / elapsed))
+        if latencies:
+            latencies.sort()
+            self.stdout.write('latency p50  {:.1f} ms'.format(1000 * statistics.median(latencies)))
+            self.stdout.write('latency p95  {:.1f} ms'.format(1000 * latencies[int(0.95 * (len(latencies) - 1))]))
+            self.stdout.write('latency max  {:.1f} ms'.format(1000 * latencies[-1]))
+
+    async def _run(self, options):
+        url = urlsplit(options['url'])
+        latencies = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                try:
+                    await self._request(url, options['client_delay'])
+                    latencies.append(time.perf_counter() - started)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+
+        await asyncio.gather(*(client() for _ in range(options['clients'])))
+        return latencies, errors
+
+    @staticmethod
+    async def _request(url, delay):
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        try:
+            request = 'GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n'.format(
+                url.path + ('?' + url.query if url.query else ''), url.netloc)
+            # Trickle the request line and headers in, as a slow client would,
+            # then finish the request and read the whole response
+            for line in request.splitlines(keepends=True):
+                writer.write(line.encode())
+                await writer.drain()
+                await asyncio.sleep(delay / 3)
+            writer.write(b'\r\n')
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line.startswith(b'HTTP/1.1 200') and not status_line.startswith(b'HTTP/1.0 200'):
+                raise ValueError(status_line)
+            await reader.read()
+        finally:
+            writer.close()
@@ -0,0 +1,94 @@
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from ninja.renderers import JSONRenderer
+from pydantic import TypeAdapter
+
+from core import renderers
+from core.models import Cruise, Cast, Niskin
+from ctd.services import CtdService, CastOutput, NiskinOutput
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare rendering large cast and niskin lists through response model '
+        'validation and the default JSON renderer with plain rows and '
+        'FastJSONRenderer. Uses unsaved model instances, so no database is needed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stderr.write('orjson is not installed; FastJSONRenderer falls back to the default renderer')
+        rng = random.Random(options['seed'])
+        self.stdout.write('{:<8} {:>8} {:>14} {:>12} {:>10} {:>7}'.format(
+            'list', 'rows', 'pydantic (s)', 'rows (s)', 'speedup', 'match'))
+
+        for size in options['sizes']:
+            casts, niskins = self._make(rng, size)
+            for name, items, serialize, row, model in (
+                ('casts', casts, CtdService.serialize_cast, CtdService.cast_row, CastOutput),
+                ('niskins', niskins, CtdService.serialize_niskin, CtdService.niskin_row, NiskinOutput),
+            ):
+                adapter = TypeAdapter(List[model])
+                baseline_time, baseline = self._best_of(
+                    options['repeat'], self._validated, items, serialize, adapter)
+                fast_time, fast = self._best_of(options['repeat'], self._plain, items, row)
+                self.stdout.write('{:<8} {:>8} {:>14.4f} {:>12.4f} {:>9.1f}x {:>7}'.format(
+                    name, size, baseline_time, fast_time, baseline_time / fast_time,
+                    str(json.loads(baseline) == json.loads(fast))))
+
+    @staticmethod
+    def _make(rng, size):
+        # Whole-second times, which both renderers format the same way
+        start = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+        cruise = Cruise(name='BENCH0001', start_time=start, end_time=start + timedelta(days=30))
+        casts = []
+        for i in range(size):
+            cast_start = start + timedelta(seconds=rng.randrange(30 * 86400))
+            casts.append(Cast(
+                cruise=cruise,
+                number=str(i + 1),
+                depth=rng.uniform(10, 500),
+                geolocation=Point(rng.uniform(-71.5, -70.0), rng.uniform(39.5, 41.5), srid=4326),
+                start_time=cast_start,
+                end_time=cast_start + timedelta(hours=1),
+            ))
+        cast = casts[0]
+        niskins = [
+            Niskin(cast=cast, number=i + 1, depth=rng.uniform(1, 500), geolocation=cast.geolocation)
+            for i in range(size)
+        ]
+        return casts, niskins
+
+    @staticmethod
+    def _validated(items, serialize, adapter):
+        # What a route with response=List[...] does with a list of models:
+        # validate against the response model, dump, then JSONRenderer
+        outputs = [serialize(item) for item in items]
+        data = adapter.dump_python(adapter.validate_python(outputs))
+        return JSONRenderer().render(None, data, response_status=200)
+
+    @staticmethod
+    def _plain(items, row):
+        return renderers.FastJSONRenderer().render(None, [row(item) for item in items], response_status=200)
+
+    @staticmethod
+    def _best_of(repeat, func, *args):
+        best, result = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - started
+            if best is None or elapsed < best:
+                best = elapsed
+        return best, result
@@ -0,0 +1,130 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Station, Vessel, Cruise, Cast, Niskin
+from ctd import cache as ctd_cache
+from ctd import resolver
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic stations with redeployment histories and cruises with '
+        'casts and niskins for benchmarking. Everything generated is named with '
+        '--prefix so that it can be removed again with --clear.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stations', type=int, default=50)
+        parser.add_argument('--deployments', type=int, default=20, help='Locations per station')
+        parser.add_argument('--cruises', type=int, default=40)
+        parser.add_argument('--casts', type=int, default=30, help='Casts per cruise')
+        parser.add_argument('--niskins', type=int, default=24, help='Niskins per cast')
+        parser.add_argument('--prefix', default='BENCH')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', help='Only remove previously generated data')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        cruise_names = list(Cruise.objects.filter(name__startswith=prefix).values_list('name', flat=True))
+        with transaction.atomic():
+            Station.objects.filter(name__startswith=prefix).delete()
+            Cruise.objects.filter(name__startswith=prefix).delete()
+            Vessel.objects.filter(name__startswith=prefix).delete()
+        self._invalidate(cruise_names)
+        if options['clear']:
+            self.stdout.write('Removed generated data with prefix {}'.format(prefix))
+            return
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            locations = self._stations(rng, prefix, options['stations'], options['deployments'])
+            casts, niskins = self._cruises(rng, prefix, options['cruises'], options['casts'], options['niskins'])
+        self._invalidate(Cruise.objects.filter(name__startswith=prefix).values_list('name', flat=True))
+
+        self.stdout.write('Generated {} stations with {} locations, {} cruises with {} casts and {} niskins'.format(
+            options['stations'], locations, options['cruises'], casts, niskins))
+
+    @staticmethod
+    def _stations(rng, prefix, count, deployments):
+        # Stations sit on the shelf south of Martha's Vineyard and are
+        # redeployed a little off their nominal position every few months
+        stations = Station.objects.bulk_create([
+            Station(name='{}-L{:03d}'.format(prefix, i), full_name='{} station {}'.format(prefix, i))
+            for i in range(count)
+        ])
+        start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        locations = []
+        for station in stations:
+            latitude, longitude = rng.uniform(39.5, 41.5), rng.uniform(-71.5, -70.0)
+            deployed = start + timedelta(days=rng.uniform(0, 60))
+            for i in range(deployments):
+                recovered = deployed + timedelta(days=rng.uniform(60, 180))
+                locations.append((station, {
+                    'latitude': latitude + rng.gauss(0, 0.005),
+                    'longitude': longitude + rng.gauss(0, 0.005),
+                    'start_time': deployed,
+                    # The latest deployment is still in the water
+                    'end_time': recovered if i < deployments - 1 else None,
+                    'depth': rng.uniform(20, 200),
+                    'comment': '',
+                }))
+                deployed = recovered + timedelta(days=rng.uniform(1, 10))
+        Station.set_locations(locations)
+        return len(locations)
+
+    @staticmethod
+    def _cruises(rng, prefix, count, casts_per_cruise, niskins_per_cast):
+        vessels = Vessel.objects.bulk_create([
+            Vessel(designation='R/V', name='{} vessel {}'.format(prefix, i),
+                   short_name='{}{}'.format(prefix, i), code='{}{}'.format(prefix, i))
+            for i in range(3)
+        ])
+        start = datetime(2018, 1, 1, tzinfo=timezone.utc)
+        cruises = []
+        for i in range(count):
+            cruise_start = start + timedelta(days=45 * i + rng.uniform(0, 20))
+            cruises.append(Cruise(
+                name='{}{:04d}'.format(prefix, i),
+                vessel=rng.choice(vessels),
+                start_time=cruise_start,
+                end_time=cruise_start + timedelta(days=rng.uniform(5, 14))))
+        cruises = Cruise.objects.bulk_create(cruises)
+
+        casts = []
+        for cruise in cruises:
+            cast_time = cruise.start_time
+            for number in range(1, casts_per_cruise + 1):
+                cast_time += timedelta(hours=rng.uniform(2, 8))
+                casts.append(Cast(
+                    cruise=cruise,
+                    number=str(number),
+                    depth=rng.uniform(20, 500),
+                    geolocation=Point(rng.uniform(-71.5, -70.0), rng.uniform(39.5, 41.5), srid=4326),
+                    start_time=cast_time,
+                    end_time=cast_time + timedelta(hours=1)))
+        casts = Cast.objects.bulk_create(casts, batch_size=1000)
+
+        niskins = []
+        for cast in casts:
+            # Bottles are fired on the way up, deepest first
+            for number in range(1, niskins_per_cast + 1):
+                niskins.append(Niskin(
+                    cast=cast,
+                    number=number,
+                    depth=cast.depth * (1 - (number - 1) / niskins_per_cast),
+                    geolocation=cast.geolocation))
+        Niskin.objects.bulk_create(niskins, batch_size=5000)
+        return len(casts), len(niskins)
+
+    @staticmethod
+    def _invalidate(cruise_names):
+        # Bulk writes bypass CtdService, so drop what it may have cached
+        # under these names in this process and in the shared version markers
+        ctd_cache.invalidate('vessels')
+        for name in cruise_names:
+            ctd_cache.invalidate_cruise(name)
+            resolver.forget_cruise(name)
@@ -0,0 +1,161 @@
+import os
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .db import pool_stats
+
+
+# Prometheus metrics for the API, served at /metrics.
+#
+# Under gunicorn every worker process keeps its own values, so
+# gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR and prometheus_client
+# writes them to files there that /metrics aggregates across all workers.
+# Without it (runserver, a single uvicorn) the in-process registry is used.
+#
+# Requests are labelled by the matched route pattern as declared on the
+# Ninja routers (e.g. "ctd/casts/get/{cruise_name}"), never by the raw path,
+# so the number of series stays bounded.
+#
+# Connection pool usage (see core/db.py) is read when /metrics is scraped,
+# from the pools of the process answering the scrape; under gunicorn that
+# is one worker per scrape, told apart by the pid label.
+
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+REQUEST_LATENCY = Histogram(
+    'api_request_duration_seconds', 'Request latency',
+    ['method', 'route'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60),
+)
+REQUEST_SIZE = Histogram('api_request_size_bytes', 'Request body size', ['method', 'route'], buckets=SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram('api_response_size_bytes', 'Response body size', ['method', 'route'], buckets=SIZE_BUCKETS)
+RESPONSES = Counter('api_responses_total', 'Responses by status code', ['method', 'route', 'status'])
+EXCEPTIONS = Counter(
+    'api_exceptions_total', 'Exceptions raised by API views, by the status code they were answered with',
+    ['route', 'exception', 'status'],
+)
+IN_FLIGHT = Gauge('api_requests_in_flight', 'Requests being handled', multiprocess_mode='livesum')
+
+_DJANGO_PARAMETER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def route_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.route:
+        return 'unmatched'
+    route = _DJANGO_PARAMETER.sub(r'{\1}', match.route)
+    return route[len('api/'):] if route.startswith('api/') else route
+
+
+def count_exception(request, exc, status):
+    EXCEPTIONS.labels(route_label(request), type(exc).__name__, status).inc()
+
+
+class ExceptionMetricsMixin:
+    # NinjaAPI mixin counting the exceptions that reach the API's exception
+    # handlers; the ones left for Django to handle end up as a 500
+    def on_exception(self, request, exc):
+        try:
+            response = super().on_exception(request, exc)
+        except Exception:
+            if is_enabled():
+                count_exception(request, exc, 500)
+            raise
+        if is_enabled():
+            count_exception(request, exc, response.status_code)
+        return response
+
+
+class PoolCollector:
+    def collect(self):
+        pid = str(os.getpid())
+        connections = GaugeMetricFamily(
+            'api_db_pool_connections', 'Pooled database connections by state', labels=['alias', 'state', 'pid'])
+        waiting = GaugeMetricFamily(
+            'api_db_pool_requests_waiting', 'Requests waiting for a pooled connection', labels=['alias', 'pid'])
+        created = GaugeMetricFamily(
+            'api_db_pool_connections_created', 'Connections opened by the pool since the process started',
+            labels=['alias', 'pid'])
+        for alias in settings.DATABASES:
+            stats = pool_stats(alias)
+            if stats is None:
+                continue
+            for state in ('size', 'in_use', 'available', 'max_size'):
+                connections.add_metric([alias, state, pid], stats[state])
+            waiting.add_metric([alias, pid], stats['waiting'])
+            created.add_metric([alias, pid], stats['created'])
+        yield connections
+        yield waiting
+        yield created
+
+
+REGISTRY.register(PoolCollector())
+
+
+def metrics_view(request):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(PoolCollector())
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            IN_FLIGHT.dec()
+        self._observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            IN_FLIGHT.dec()
+        self._observe(request, response, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _observe(request, response, elapsed):
+        route = route_label(request)
+        if route == 'metrics':
+            return
+        REQUEST_LATENCY.labels(request.method, route).observe(elapsed)
+        REQUEST_SIZE.labels(request.method, route).observe(int(request.META.get('CONTENT_LENGTH') or 0))
+        # A streamed body's size is not known when the response leaves the view
+        if not response.streaming:
+            RESPONSE_SIZE.labels(request.method, route).observe(len(response.content))
+        RESPONSES.labels(request.method, route, response.status_code).inc()
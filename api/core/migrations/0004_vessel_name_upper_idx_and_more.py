@@ -0,0 +1,26 @@
+# Generated by Django 5.1 on 2026-10-17 10:12
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_vessel_designation_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vessel',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='vessel_name_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cruise',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='cruise_name_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cast',
+            index=models.Index(models.F('cruise'), django.db.models.functions.text.Upper('number'), name='cast_cruise_number_upper_idx'),
+        ),
+    ]
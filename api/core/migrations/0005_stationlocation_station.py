@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-17 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0004_vessel_name_upper_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stationlocation',
+            name='station',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='core.station'),
+        ),
+        # Nullable so that reversing 0007 can re-add them empty for 0006 to refill
+        migrations.AlterField(
+            model_name='stationlocation',
+            name='content_type',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AlterField(
+            model_name='stationlocation',
+            name='object_id',
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+def copy_station_ids(apps, schema_editor):
+    # object_id of every location attached to a Station becomes station_id.
+    # Locations attached to anything else, or to a station that no longer
+    # exists, were unreachable from any station and are dropped.
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Station = apps.get_model('core', 'Station')
+    StationLocation = apps.get_model('core', 'StationLocation')
+    content_type = ContentType.objects.filter(app_label='core', model='station').first()
+    if content_type is not None:
+        StationLocation.objects.filter(
+            content_type=content_type,
+            object_id__in=Station.objects.values('id'),
+        ).update(station_id=models.F('object_id'))
+    StationLocation.objects.filter(station__isnull=True).delete()
+
+
+def copy_object_ids(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    StationLocation = apps.get_model('core', 'StationLocation')
+    content_type, _ = ContentType.objects.get_or_create(app_label='core', model='station')
+    StationLocation.objects.update(content_type=content_type, object_id=models.F('station_id'))
+
+
+class Migration(migrations.Migration):
+
+    # Data only, in its own migration: PostgreSQL cannot alter a table with
+    # deferred foreign key checks pending in the same transaction
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0005_stationlocation_station'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_station_ids, copy_object_ids),
+    ]
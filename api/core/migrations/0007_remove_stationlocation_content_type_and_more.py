@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-17 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_copy_stationlocation_station'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stationlocation',
+            name='station',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='locations', to='core.station'),
+        ),
+        migrations.RemoveField(
+            model_name='stationlocation',
+            name='content_type',
+        ),
+        migrations.RemoveField(
+            model_name='stationlocation',
+            name='object_id',
+        ),
+        migrations.AddIndex(
+            model_name='stationlocation',
+            index=models.Index(fields=['station', '-start_time'], name='stationloc_station_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stationlocation',
+            index=models.Index(fields=['start_time', 'end_time'], name='stationloc_period_idx'),
+        ),
+    ]
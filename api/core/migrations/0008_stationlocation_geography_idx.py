@@ -0,0 +1,19 @@
+# Generated by Django 5.1 on 2026-10-17 13:05
+
+import core.models
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_remove_stationlocation_content_type_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stationlocation',
+            index=django.contrib.postgres.indexes.GistIndex(core.models.AsGeography('geolocation'), name='stationloc_geography_idx'),
+        ),
+    ]
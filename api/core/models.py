@@ -1,18 +1,18 @@
 from django.db import models as models
+from django.db import connection, transaction
 from django.contrib.gis.db import models as gis_models
-from django.contrib.gis.geos import Point
-from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.postgres.indexes import GistIndex
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from django.db.models.functions import Upper
 from django.utils import timezone
 from django.db.models import UniqueConstraint
 
+from .signals import station_locations_changed
 
-# Ability to add a timestamp to any model instance
+
+# Ability to add a time interval to any model
 class TimeStampedModelInstance(models.Model):
-    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
-    object_id = models.PositiveIntegerField()
-    content_object = GenericForeignKey('content_type', 'object_id')
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
 
@@ -20,24 +20,59 @@ class TimeStampedModelInstance(models.Model):
         abstract = True
 
 
+# (geometry)::geography. Queries that order or filter on it are served by
+# the GiST expression index on StationLocation, which is built from the same
+# expression so the planner can match the two.
+class AsGeography(Func):
+    template = '(%(expressions)s)::geography'
+    output_field = gis_models.PointField(geography=True)
+
+
+# KNN distance operator. On geography it is the great-circle distance in
+# meters, so a GiST index scan returns rows already in the same order as
+# ST_DistanceSphere.
+class KnnDistance(Func):
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
+
+
+# ST_DWithin on a sphere (use_spheroid false), also index-assisted
+class DWithinSphere(Func):
+    function = 'ST_DWithin'
+    template = '%(function)s(%(expressions)s, false)'
+    output_field = BooleanField()
+
+
 # Location of an NES-LTER station at a given time
 class StationLocation(TimeStampedModelInstance):
+    station = models.ForeignKey('Station', on_delete=models.CASCADE, related_name='locations')
     geolocation = gis_models.PointField()
     depth = models.FloatField(null=True, blank=True)
     comment = models.TextField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # A station's timeline, newest first: get_location, set_location
+            # and the DISTINCT ON in Station.active_locations
+            models.Index(fields=['station', '-start_time'], name='stationloc_station_start_idx'),
+            # Locations active at a timestamp, across all stations
+            models.Index(fields=['start_time', 'end_time'], name='stationloc_period_idx'),
+            # Nearest-neighbour and radius searches (see Station.distances)
+            GistIndex(AsGeography('geolocation'), name='stationloc_geography_idx'),
+        ]
+
     def get_station(self):
-        return self.content_object
+        return self.station
     
     def __str__(self):
-        return '{}: {} {}'.format(self.content_object, self.geolocation.y, self.geolocation.x)
+        return '{}: {} {}'.format(self.station, self.geolocation.y, self.geolocation.x)
 
 
 # Station model with locations
 class Station(models.Model):
     name = models.CharField(max_length=100, unique=True)
     full_name = models.CharField(max_length=200, null=True, blank=True)
-    locations = GenericRelation(StationLocation, related_query_name='station')
 
     def set_location(self, latitude, longitude, start_time, end_time=None, depth=None, comment=None):
         if end_time is not None:
@@ -49,6 +84,9 @@ class Station(models.Model):
         if self.locations.filter(start_time=start_time).exists():
             raise ValueError('A location already exists at the given start_time')
 
+        if self.locations.filter(start_time__lt=start_time, end_time__gt=start_time).exists():
+            raise ValueError('start_time must be greater than or equal to the end_time of the predecessor location')
+
         # Create a new Point object for the geolocation
         geolocation = Point(longitude, latitude, srid=4326)
  
@@ -66,7 +104,7 @@ class Station(models.Model):
 
         # Create a new StationLocation linked to this Station
         StationLocation.objects.create(
-            content_object=self,
+            station=self,
             geolocation=geolocation,
             depth=depth,
             start_time=start_time,
@@ -74,85 +112,328 @@ class Station(models.Model):
             comment=comment
         )
 
+        station_locations_changed.send(sender=self.__class__, station=self)
+
+    @classmethod
+    def set_locations(cls, locations):
+        # Batch form of set_location. locations is an iterable of
+        # (station, dict of set_location arguments). Each station's new
+        # locations are applied in start_time order to an in-memory copy of its
+        # timeline, following the same steps as set_location, and everything
+        # is then written in one transaction: one query to load the
+        # timelines, one bulk update of closed intervals and one bulk insert.
+        by_station = {}
+        for station, location in locations:
+            location = dict(location)
+            for field in ('start_time', 'end_time'):
+                if location.get(field) is not None and timezone.is_naive(location[field]):
+                    location[field] = timezone.make_aware(location[field])
+            by_station.setdefault(station, []).append(location)
+
+        with transaction.atomic():
+            timelines = {station.pk: [] for station in by_station}
+            existing = StationLocation.objects.select_for_update().filter(station_id__in=timelines.keys())
+            for location in existing:
+                timelines[location.station_id].append(location)
+
+            changed = {}
+            created = []
+            for station, new_locations in by_station.items():
+                timeline = timelines[station.pk]
+                for location in sorted(new_locations, key=lambda location: location['start_time']):
+                    try:
+                        created.append(cls._apply_location(station, timeline, changed, **location))
+                    except ValueError as e:
+                        raise ValueError('{} at {}: {}'.format(station.name, location['start_time'].isoformat(), e))
+
+            # Locations created in this batch are inserted with their final end_time
+            StationLocation.objects.bulk_update(
+                [location for location in changed.values() if location.pk is not None], ['end_time'])
+            StationLocation.objects.bulk_create(created)
+
+        for station in by_station:
+            station_locations_changed.send(sender=cls, station=station)
+
+    @staticmethod
+    def _apply_location(station, timeline, changed, latitude, longitude, start_time, end_time=None, depth=None, comment=None):
+        # In-memory equivalent of set_location on a station's timeline.
+        # Rows with a NULL start_time never match a comparison, as in SQL.
+        if end_time is not None:
+            if end_time == start_time:
+                raise ValueError('start and end time must not be identical')
+            elif end_time < start_time:
+                raise ValueError('end_time must be greater than or equal to start_time')
+
+        if any(location.start_time == start_time for location in timeline):
+            raise ValueError('A location already exists at the given start_time')
+
+        if any(
+            location.start_time is not None and location.start_time < start_time
+            and location.end_time is not None and location.end_time > start_time
+            for location in timeline
+        ):
+            raise ValueError('start_time must be greater than or equal to the end_time of the predecessor location')
+
+        later = [location for location in timeline if location.start_time is not None and location.start_time > start_time]
+        successor = min(later, key=lambda location: location.start_time) if later else None
+
+        if successor is not None:
+            if end_time is None:
+                end_time = successor.start_time
+            if end_time > successor.start_time:
+                raise ValueError('end_time must be less than or equal to the start_time of the successor location')
+
+        for location in timeline:
+            if location.start_time is not None and location.start_time < start_time and location.end_time is None:
+                location.end_time = start_time
+                changed[id(location)] = location
+
+        location = StationLocation(
+            station=station,
+            geolocation=Point(longitude, latitude, srid=4326),
+            depth=depth,
+            start_time=start_time,
+            end_time=end_time,
+            comment=comment
+        )
+        timeline.append(location)
+        return location
+
     def get_location(self, timestamp=None):
         if timestamp is None:
             timestamp = timezone.now()
 
-        locations = self.locations.filter(
+        return self.locations.filter(
             Q(end_time__gte=timestamp) | Q(end_time__isnull=True),
             start_time__lte=timestamp
-        ).order_by('-start_time')
+        ).order_by('-start_time').first()
 
-        if locations.exists():
-            return locations.first()
-        else:
-            return None
+    @classmethod
+    def active_locations(cls, timestamp):
+        # Most recent active location of every station in a single query:
+        # DISTINCT ON keeps the first row per station, and the station name
+        # is joined in rather than fetched through location.station per row
+        return (
+            StationLocation.objects.filter(
+                Q(end_time__gte=timestamp) | Q(end_time__isnull=True),
+                start_time__lte=timestamp
+            )
+            .annotate(station_name=F('station__name'))
+            .order_by('station_id', '-start_time')
+            .distinct('station_id')
+        )
 
     @classmethod
     def get_locations(cls, timestamp=None):
         if timestamp is None:
             timestamp = timezone.now()
 
-        locations = []
+        return list(cls.active_locations(timestamp))
 
-        for station in cls.objects.all():
-            location = station.get_location(timestamp)
-            if location is not None:
-                locations.append(location)
+    @classmethod
+    async def aget_locations(cls, timestamp=None):
+        if timestamp is None:
+            timestamp = timezone.now()
 
-        return locations
+        return [location async for location in cls.active_locations(timestamp)]
     
     @classmethod
-    def distances(cls, latitude, longitude, timestamp):
+    def distances(cls, latitude, longitude, timestamp, max_distance_km=None):
         from django.contrib.gis.db.models.functions import Distance
 
         # Create a Point object from the latitude and longitude
         geolocation = Point(longitude, latitude, srid=4326)
+        geography = AsGeography(Value(geolocation, output_field=gis_models.PointField(srid=4326)))
 
-        return StationLocation.objects.filter(
+        locations = StationLocation.objects.filter(
             Q(end_time__gte=timestamp) | Q(end_time__isnull=True),
             start_time__lte=timestamp
-        ).annotate(distance=Distance('geolocation', geolocation)).order_by('distance')
+        ).annotate(
+            distance=Distance('geolocation', geolocation),
+            station_name=F('station__name')
+        )
+        if max_distance_km is not None:
+            locations = locations.filter(
+                DWithinSphere(AsGeography('geolocation'), geography, Value(max_distance_km * 1000)))
+
+        # Ordered by the KNN operator rather than the distance annotation, so
+        # that the nearest rows come straight off the GiST index instead of
+        # every active location being measured and sorted
+        return locations.order_by(KnnDistance(AsGeography('geolocation'), geography))
 
 
     @classmethod
-    def nearest_location(cls, latitude, longitude, timestamp=None):
+    def nearest_location(cls, latitude, longitude, timestamp=None, max_distance_km=None):
         if timestamp is None:
             timestamp = timezone.now()
 
-        distances = cls.distances(latitude, longitude, timestamp)
+        return cls.distances(latitude, longitude, timestamp, max_distance_km).first()
+
+    @classmethod
+    async def anearest_location(cls, latitude, longitude, timestamp=None, max_distance_km=None):
+        if timestamp is None:
+            timestamp = timezone.now()
 
-        if distances.exists():
-            return distances.first()
-        else:
-            return None
+        return await cls.distances(latitude, longitude, timestamp, max_distance_km).afirst()
+
+    @classmethod
+    def within_radius(cls, latitude, longitude, radius_km, timestamp=None):
+        # Every location active at timestamp within radius_km, nearest first
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        return cls.distances(latitude, longitude, timestamp, max_distance_km=radius_km)
+
+    @classmethod
+    def within_bbox(cls, west, south, east, north, timestamp=None):
+        # Every location active at timestamp inside the box, nearest to its
+        # center first. The containment test is served by the GiST index on
+        # the geometry column.
+        if timestamp is None:
+            timestamp = timezone.now()
+
+        bbox = Polygon.from_bbox((west, south, east, north))
+        bbox.srid = 4326
+
+        return cls.distances((south + north) / 2, (west + east) / 2, timestamp).filter(geolocation__coveredby=bbox)
         
 
     @classmethod
     def add_nearest_station(cls, latitude, longitude, timestamp):
+        # Resolve the whole batch in a single round trip instead of one
+        # nearest_location() call per point
+        return cls._nearest_stations(NEAREST_STATIONS_SQL, latitude, longitude, timestamp)
+
+    @staticmethod
+    def _nearest_stations(sql, latitude, longitude, timestamp):
+        if len(timestamp) == 0:
+            return [], []
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [list(latitude), list(longitude), list(timestamp)])
+            rows = cursor.fetchall()
+
         nearest_station_name = []
         nearest_station_distance = []
-        for latitude, longitude, timestamp in zip(latitude, longitude, timestamp):
-            location = cls.nearest_location(latitude, longitude, timestamp)
-            if location is not None:
-                nearest_station_name.append(location.content_object.name)
-                nearest_station_distance.append(location.distance.km)
-            else:
-                nearest_station_name.append(None)
-                nearest_station_distance.append(None)
+        for name, distance in rows:
+            nearest_station_name.append(name)
+            # ST_DistanceSphere returns meters, same as the Distance annotation
+            nearest_station_distance.append(distance / 1000 if distance is not None else None)
         return nearest_station_name, nearest_station_distance
 
 
+    @classmethod
+    def station_passes(cls, latitude, longitude, timestamp, radius_km):
+        # Intervals during which a time-ordered track stayed within radius_km
+        # of a station, as (station name, start, end, closest time, minimum
+        # distance in km, number of fixes) rows in order of start time
+        if len(timestamp) == 0:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(STATION_PASSES_SQL, [list(latitude), list(longitude), list(timestamp), radius_km * 1000])
+            rows = cursor.fetchall()
+
+        return [
+            (name, start_time, end_time, closest_time, distance / 1000, fixes)
+            for name, start_time, end_time, closest_time, distance, fixes in rows
+        ]
+
+
     def __str__(self):
         return self.name
 
 
+# Set-based version of Station.nearest_location: the input arrays are unnested
+# and each point is laterally joined to its nearest active StationLocation,
+# found with the same KNN ordering on the geography index.
+# Distance('geolocation', point) on a geodetic geometry field compiles to
+# ST_DistanceSphere, so the distances match the per-point query exactly.
+def _nearest_stations_sql(timestamps):
+    return """
+    SELECT station.name, nearest.distance
+    FROM unnest(%s::double precision[], %s::double precision[], {timestamps})
+        WITH ORDINALITY AS p(latitude, longitude, ts, ordinality)
+    LEFT JOIN LATERAL (
+        SELECT location.station_id,
+               ST_DistanceSphere(
+                   location.geolocation,
+                   ST_SetSRID(ST_MakePoint(p.longitude, p.latitude), 4326)
+               ) AS distance
+        FROM {location_table} AS location
+        WHERE location.start_time <= p.ts
+          AND (location.end_time >= p.ts OR location.end_time IS NULL)
+        ORDER BY (location.geolocation)::geography
+            <-> (ST_SetSRID(ST_MakePoint(p.longitude, p.latitude), 4326))::geography
+        LIMIT 1
+    ) AS nearest ON true
+    LEFT JOIN {station_table} AS station ON station.id = nearest.station_id
+    ORDER BY p.ordinality
+""".format(
+        timestamps=timestamps,
+        location_table=StationLocation._meta.db_table,
+        station_table=Station._meta.db_table,
+    )
+
+
+NEAREST_STATIONS_SQL = _nearest_stations_sql('%s::timestamptz[]')
+
+
+# Station passes along a track in one query. Every fix is joined to the
+# station locations active at its time and within the radius (ST_DWithin on
+# the geography index). Consecutive fixes near the same location then form
+# one pass (gaps and islands: the fix number minus its rank within the
+# location is constant along a run), so a pass ends when the track leaves
+# the radius or when the station moves to a new location.
+STATION_PASSES_SQL = """
+    WITH track AS (
+        SELECT p.ordinality AS fix, p.ts,
+               ST_SetSRID(ST_MakePoint(p.longitude, p.latitude), 4326) AS geom
+        FROM unnest(%s::double precision[], %s::double precision[], %s::timestamptz[])
+            WITH ORDINALITY AS p(latitude, longitude, ts, ordinality)
+    ),
+    hits AS (
+        SELECT location.id AS location_id, location.station_id, track.fix, track.ts,
+               ST_DistanceSphere(location.geolocation, track.geom) AS distance
+        FROM track
+        JOIN {location_table} AS location
+          ON location.start_time <= track.ts
+         AND (location.end_time >= track.ts OR location.end_time IS NULL)
+         AND ST_DWithin((location.geolocation)::geography, (track.geom)::geography, %s, false)
+    ),
+    runs AS (
+        SELECT hits.*,
+               hits.fix - row_number() OVER (PARTITION BY hits.location_id ORDER BY hits.fix) AS run
+        FROM hits
+    )
+    SELECT station.name,
+           min(runs.ts),
+           max(runs.ts),
+           (array_agg(runs.ts ORDER BY runs.distance, runs.fix))[1],
+           min(runs.distance),
+           count(*)
+    FROM runs
+    JOIN {station_table} AS station ON station.id = runs.station_id
+    GROUP BY runs.location_id, runs.run, station.name
+    ORDER BY min(runs.fix), station.name
+""".format(
+    location_table=StationLocation._meta.db_table,
+    station_table=Station._meta.db_table,
+)
+
+
 class Vessel(models.Model):
     designation = models.CharField(max_length=32) # e.g., "R/V"
     name = models.CharField(max_length=100, unique=True) # e.g., "Neil Armstrong"
     short_name = models.CharField(max_length=32, unique=True) # e.g., "Armstrong"
     code = models.CharField(max_length=32, unique=True) # e.g., "AR"
 
+    class Meta:
+        indexes = [
+            # Serves name__iexact lookups, which compile to UPPER(name) = UPPER(%s)
+            models.Index(Upper('name'), name='vessel_name_upper_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -163,6 +444,11 @@ class Cruise(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(Upper('name'), name='cruise_name_upper_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -179,6 +465,9 @@ class Cast(models.Model):
         constraints = [
             UniqueConstraint(fields=['cruise', 'number'], name='unique_cruise_cast_number')
         ]
+        indexes = [
+            models.Index('cruise', Upper('number'), name='cast_cruise_number_upper_idx'),
+        ]
 
     def __str__(self):
         return '{} cast {}'.format(self.cruise, self.number)
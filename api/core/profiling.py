@@ -0,0 +1,156 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from ninja.errors import HttpError
+
+from .auth import TokenAuthenticator
+
+
+# On-demand profiling of a single request. A staff user authenticated with
+# their API token sends "X-Profile: store" (or "1") to have the call tree
+# and the SQL of that request written to PROFILE_DIR, named by the id in
+# the X-Profile-Id response header, or "X-Profile: inline" to get the
+# report back instead of the normal response. Requests without the header
+# only pay for one dictionary lookup, plus one context variable read per
+# SQL query in the query hook.
+#
+# Queries are recorded by a connection_created hook that reports to the
+# profile in the current context, which asgiref copies into sync_to_async
+# threads, so the SQL list is complete for async views too. The call tree
+# comes from cProfile on the thread handling the request. For an async view
+# under ASGI that is the event loop thread: it shows the view's coroutines
+# and, interleaved with them, those of any other request running on the
+# same worker meanwhile, but not the ORM work done in sync_to_async threads
+# (only its SQL). Profile a quiet worker, or run the view under WSGI, for a
+# complete call tree.
+
+HEADER = 'HTTP_X_PROFILE'
+MODES = ('1', 'store', 'inline')
+
+_current = ContextVar('request_profile', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries.append({
+            'alias': context['connection'].alias,
+            'sql': sql,
+            'params': repr(params),
+            'many': many,
+            'ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+
+
+def install_query_hook(sender, connection, **kwargs):
+    # connection_created receiver; a connection object can be reconnected
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ProfileMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.authenticator = TokenAuthenticator()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if HEADER not in request.META:
+            return self.get_response(request)
+        denied = self._check(request)
+        if denied is not None:
+            return denied
+        profile = RequestProfile()
+        with profile:
+            response = self.get_response(request)
+        return profile.finish(request, response)
+
+    async def __acall__(self, request):
+        if HEADER not in request.META:
+            return await self.get_response(request)
+        # Token authentication queries the database
+        denied = await sync_to_async(self._check)(request)
+        if denied is not None:
+            return denied
+        profile = RequestProfile()
+        with profile:
+            response = await self.get_response(request)
+        return profile.finish(request, response)
+
+    def _check(self, request):
+        if request.META[HEADER] not in MODES:
+            return JsonResponse({'detail': 'X-Profile must be one of {}'.format(', '.join(MODES))}, status=400)
+        try:
+            user, _ = self.authenticator(request)
+        except HttpError as e:
+            return JsonResponse({'detail': e.message}, status=e.status_code)
+        if not user.is_staff:
+            return JsonResponse({'detail': 'Profiling requires a staff user'}, status=403)
+        return None
+
+
+class RequestProfile:
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.queries = []
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.started
+        _current.reset(self._token)
+
+    def report(self, request, response):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(60)
+        stats.print_callees(20)
+        return {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'total_ms': round(self.elapsed * 1000, 3),
+            'query_count': len(self.queries),
+            'query_ms': round(sum(query['ms'] for query in self.queries), 3),
+            'queries': self.queries,
+            'call_tree': stream.getvalue(),
+        }
+
+    def finish(self, request, response):
+        report = self.report(request, response)
+        if request.META[HEADER] == 'inline':
+            return JsonResponse(report)
+
+        profile_id = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+        directory = Path(settings.PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        # .prof loads into pstats or snakeviz; .json has the SQL and the text report
+        self.profiler.dump_stats(directory / '{}.prof'.format(profile_id))
+        (directory / '{}.json'.format(profile_id)).write_text(json.dumps(report, indent=2))
+        response['X-Profile-Id'] = profile_id
+        return response
@@ -0,0 +1,33 @@
+from ninja.renderers import JSONRenderer
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# JSON rendering for the API. orjson encodes dicts, lists, tuples, floats and
+# datetimes natively; anything else (pydantic models, Decimal, UUID, ...)
+# goes through the same encoder as the default renderer. Without orjson this
+# is the default renderer.
+#
+# List endpoints can skip response model validation entirely by building
+# plain rows and returning render_rows(); the route keeps its response=
+# schema for OpenAPI, so the rows must have the same fields, in the same
+# order, as the declared model.
+
+_encoder = NinjaJSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, request, data, *, response_status):
+        if orjson is None:
+            return super().render(request, data, response_status=response_status)
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_UTC_Z)
+
+
+def render_rows(router, request, response, rows):
+    # response is the view's temporal response, so headers set on it (ETag,
+    # Link, ...) are kept
+    return router.api.create_response(request, rows, temporal_response=response)
@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent by Station after its location timeline has been written, so that
+# anything derived from station positions can be rebuilt or invalidated
+station_locations_changed = Signal()
@@ -1,3 +1,102 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+
+from core import timing
+from core.models import Vessel
+from ctd.services import CtdService
+
+
+class ProfileMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff_token = Token.objects.create(
+            user=User.objects.create_user('admin', password='admin', is_staff=True))
+        cls.user_token = Token.objects.create(
+            user=User.objects.create_user('user', password='user'))
+        Vessel.objects.create(designation='R/V', name='Neil Armstrong', short_name='Armstrong', code='AR')
+
+    def headers(self, token, mode='inline'):
+        return {'Authorization': 'Token {}'.format(token.key), 'X-Profile': mode}
+
+    async def test_async_view_queries_are_recorded(self):
+        # The ORM runs in sync_to_async threads, not on the event loop
+        response = await self.async_client.get('/api/ctd/vessels/get/all', headers=self.headers(self.staff_token))
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertGreater(report['query_count'], 0)
+        self.assertTrue(any('core_vessel' in query['sql'] for query in report['queries']))
+
+    def test_sync_request_queries_are_recorded(self):
+        response = self.client.get('/api/ctd/vessels/get/all', headers=self.headers(self.staff_token))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.json()['query_count'], 0)
+
+    def test_requires_staff(self):
+        response = self.client.get('/api/ctd/vessels/get/all', headers=self.headers(self.user_token))
+        self.assertEqual(response.status_code, 403)
+
+    def test_requires_token(self):
+        response = self.client.get('/api/ctd/vessels/get/all', headers={'X-Profile': 'inline'})
+        self.assertEqual(response.status_code, 401)
+
+
+class MetricsTests(TestCase):
+    ROUTE = 'ctd/cruises/get/{cruise_id}'
+
+    def exceptions(self, exception, status):
+        labels = {'route': self.ROUTE, 'exception': exception, 'status': str(status)}
+        return REGISTRY.get_sample_value('api_exceptions_total', labels) or 0
+
+    def test_requests_are_labelled_by_route(self):
+        self.client.get('/api/ctd/cruises/get/AR001')
+        content = self.client.get('/metrics').content.decode()
+        self.assertIn('api_request_duration_seconds_count{method="GET",route="%s"}' % self.ROUTE, content)
+        self.assertNotIn('route="ctd/cruises/get/AR001"', content)
+
+    def test_http_exceptions_are_counted(self):
+        before = self.exceptions('Http404', 404)
+        self.assertEqual(self.client.get('/api/ctd/cruises/get/AR001').status_code, 404)
+        self.assertEqual(self.exceptions('Http404', 404), before + 1)
+
+    def test_unhandled_exceptions_are_counted(self):
+        before = self.exceptions('RuntimeError', 500)
+        with mock.patch.object(CtdService, 'aget_cruise', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get('/api/ctd/cruises/get/AR001')
+        self.assertEqual(self.exceptions('RuntimeError', 500), before + 1)
+
+
+class ServerTimingTests(TestCase):
+    # Middleware is loaded by each test's client on its first request, so
+    # overriding the setting per test is enough
+
+    @classmethod
+    def setUpTestData(cls):
+        Vessel.objects.create(designation='R/V', name='Neil Armstrong', short_name='Armstrong', code='AR')
+
+    def setUp(self):
+        # A cached response would not query at all
+        for alias in ('default', 'ctd'):
+            caches[alias].clear()
+
+    @override_settings(REQUEST_TIMING_ENABLED=True)
+    def test_header_when_enabled(self):
+        # The query hook is only installed at startup when timing is enabled
+        with connection.execute_wrapper(timing.record_query):
+            response = self.client.get('/api/ctd/vessels/get/all')
+        self.assertEqual(response.status_code, 200)
+        entries = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(entries), {'db', 'serialize', 'total'})
+        self.assertNotIn('desc="0 queries"', entries['db'])
+
+    @override_settings(REQUEST_TIMING_ENABLED=False)
+    def test_no_header_when_disabled(self):
+        response = self.client.get('/api/ctd/vessels/get/all')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
@@ -0,0 +1,156 @@
+import functools
+import inspect
+import json
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from ninja import NinjaAPI
+
+
+# Opt-in per-request timing (REQUEST_TIMING_ENABLED). For every API request
+# it records the number of SQL queries and the time spent in them, the time
+# from the view returning to the response being rendered (response model
+# validation and JSON encoding) and the total, and reports them in a
+# Server-Timing header and one JSON log line on the "api.timing" logger.
+#
+# The state lives in a context variable, which asgiref copies into the
+# threads that run sync ORM calls for async views, so queries are counted
+# wherever they run. When timing is disabled the middleware removes itself
+# and the query hook does nothing but read the (unset) context variable.
+
+logger = logging.getLogger('api.timing')
+
+_current = ContextVar('request_timing', default=None)
+
+
+def is_enabled():
+    return getattr(settings, 'REQUEST_TIMING_ENABLED', False)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.view_returned = None
+        self.serialize = None
+
+    def server_timing(self, total):
+        metrics = ['db;dur={:.1f};desc="{} queries"'.format(self.db * 1000, self.queries)]
+        if self.serialize is not None:
+            metrics.append('serialize;dur={:.1f}'.format(self.serialize * 1000))
+        metrics.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(metrics)
+
+
+def record_query(execute, sql, params, many, context):
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db += time.perf_counter() - started
+        timing.queries += 1
+
+
+def install_query_hook(sender, connection, **kwargs):
+    # connection_created receiver; a connection object can be reconnected
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _mark_view_returned():
+    timing = _current.get()
+    if timing is not None:
+        timing.view_returned = time.perf_counter()
+
+
+def instrument(*routers):
+    # Wrap every operation's view so the end of the view itself is known
+    for router in routers:
+        for path_view in router.path_operations.values():
+            for operation in path_view.operations:
+                operation.view_func = _wrap_view(operation.view_func)
+
+
+def _wrap_view(view_func):
+    if inspect.iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def view(*args, **kwargs):
+            result = await view_func(*args, **kwargs)
+            _mark_view_returned()
+            return result
+    else:
+        @functools.wraps(view_func)
+        def view(*args, **kwargs):
+            result = view_func(*args, **kwargs)
+            _mark_view_returned()
+            return result
+    return view
+
+
+class InstrumentedNinjaAPI(NinjaAPI):
+    def create_response(self, request, data, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().create_response(request, data, *args, **kwargs)
+        timing = _current.get()
+        if timing is not None:
+            # A view returning render_rows() renders before it returns
+            since = timing.view_returned if timing.view_returned is not None else started
+            timing.serialize = time.perf_counter() - since
+        return response
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timing)
+
+    @staticmethod
+    def _finish(request, response, timing):
+        total = time.perf_counter() - timing.started
+        response['Server-Timing'] = timing.server_timing(total)
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': match.route if match is not None else None,
+            'status': response.status_code,
+            'queries': timing.queries,
+            'db_ms': round(timing.db * 1000, 3),
+            'serialize_ms': round(timing.serialize * 1000, 3) if timing.serialize is not None else None,
+            'total_ms': round(total * 1000, 3),
+        }))
+        return response
@@ -1,18 +1,29 @@
 from django.urls import path
-from ninja import NinjaAPI
 from rest_framework.authtoken.views import obtain_auth_token
 
 from core.api import router as core_router
 from stations.api import router as stations_router
 from ctd.api import router as ctd_router
+from core.metrics import ExceptionMetricsMixin, metrics_view
+from core.renderers import FastJSONRenderer
+from core.timing import InstrumentedNinjaAPI, instrument, is_enabled as timing_enabled
 
-api = NinjaAPI()
+
+class API(ExceptionMetricsMixin, InstrumentedNinjaAPI):
+    pass
+
+
+api = API(renderer=FastJSONRenderer())
 
 api.add_router('', core_router)
 api.add_router('/stations/', stations_router)
 api.add_router('/ctd/', ctd_router)
 
+if timing_enabled():
+    instrument(core_router, stations_router, ctd_router)
+
 urlpatterns = [
     path('api/login', obtain_auth_token), # a bit of a hack to use the DRF obtain_auth_token view
     path('api/', api.urls),
+    path('metrics', metrics_view),
 ]
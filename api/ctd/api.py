@@ -1,25 +1,47 @@
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
+from django.http import HttpResponse
 from ninja import Router
 
+from core.conditional import conditional_response
+from core.renderers import render_rows
+
+from .pagination import get_page, set_page_headers
+
 from .services import CtdService, NiskinInput, VesselOutput, AddVesselInput, \
     UpdateVesselInput, CruiseOutput, AddCruiseInput,  \
     UpdateCruiseInput, CastOutput, CastInput, UpdateCastInput, \
-    NiskinInput, NiskinOutput, UpdateNiskinInput
+    NiskinInput, NiskinOutput, UpdateNiskinInput, BulkCruiseInput, BulkCruiseOutput
 
 
 router = Router()
 
 
+@router.get("cache/stats")
+def get_cache_stats(request):
+    return CtdService.get_cache_stats()
+
+
 @router.get("vessels/get/all", response=List[VesselOutput])
-def get_vessels(request):
-    return CtdService.get_vessels()
+async def get_vessels(request, response: HttpResponse, limit: Optional[int] = None, cursor: Optional[str] = None):
+    page = get_page(limit, cursor)
+    validators = await CtdService.aget_validators('vessels')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    vessels = await CtdService.aget_vessels(page)
+    set_page_headers(request, response, page)
+    return render_rows(router, request, response, vessels)
 
 
 @router.get("vessels/get/{vessel_name}", response=VesselOutput)
-def get_vessel(request, vessel_name: str):
-    return CtdService.get_vessel(vessel_name)
+async def get_vessel(request, response: HttpResponse, vessel_name: str):
+    validators = await CtdService.aget_validators('vessels')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    return await CtdService.aget_vessel(vessel_name)
 
 
 @router.post('vessels/create')
@@ -40,13 +62,24 @@ def update_vessel(request, vessel_name: str, input: UpdateVesselInput):
 
 
 @router.get("cruises/get/all", response=List[CruiseOutput])
-def get_cruises(request):
-    return CtdService.get_cruises()
+async def get_cruises(request, response: HttpResponse, limit: Optional[int] = None, cursor: Optional[str] = None):
+    page = get_page(limit, cursor)
+    validators = await CtdService.aget_validators('cruises')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    cruises = await CtdService.aget_cruises(page)
+    set_page_headers(request, response, page)
+    return render_rows(router, request, response, cruises)
 
 
 @router.get("cruises/get/{cruise_id}", response=CruiseOutput)
-def get_cruise(request, cruise_id: str):
-    return CtdService.get_cruise(cruise_id)
+async def get_cruise(request, response: HttpResponse, cruise_id: str):
+    validators = await CtdService.aget_validators('cruises')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    return await CtdService.aget_cruise(cruise_id)
 
 @router.post('cruises/create')
 def create_cruise(request, input: AddCruiseInput):
@@ -76,13 +109,24 @@ def delete_cruise(request, cruise_name: str):
     
     
 @router.get("casts/get/{cruise_name}", response=List[CastOutput])
-def get_casts(request, cruise_name: str):
-    return CtdService.get_casts(cruise_name)
+async def get_casts(request, response: HttpResponse, cruise_name: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    page = get_page(limit, cursor)
+    validators = await CtdService.aget_validators('casts')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    casts = await CtdService.aget_casts(cruise_name, page)
+    set_page_headers(request, response, page)
+    return render_rows(router, request, response, casts)
 
 
 @router.get("cast/get/{cruise_name}/{cast_number}", response=CastOutput)
-def get_cast(request, cruise_name: str, cast_number: str):
-    return CtdService.get_cast(cruise_name, cast_number)
+async def get_cast(request, response: HttpResponse, cruise_name: str, cast_number: str):
+    validators = await CtdService.aget_validators('casts')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    return await CtdService.aget_cast(cruise_name, cast_number)
 
 @router.post('casts/create')
 def create_cast(request, input: CastInput):
@@ -92,6 +136,11 @@ def create_cast(request, input: CastInput):
     except ValueError as e:
         return {"status": "error", "message": str(e)}
     
+@router.post('casts/bulk/{cruise_name}', response=BulkCruiseOutput)
+def ingest_cruise(request, cruise_name: str, input: BulkCruiseInput):
+    return CtdService.ingest_cruise(cruise_name, input)
+
+
 @router.post('casts/update/{cruise_name}/{cast_number}')
 def update_cast(request, cruise_name: str, cast_number: str, input: UpdateCastInput):
     try:
@@ -121,13 +170,24 @@ def create_niskin(request, input: NiskinInput):
 
 
 @router.get("niskins/get/all/{cruise_name}/{cast_number}", response=List[NiskinOutput])
-def get_niskins(request, cruise_name: str, cast_number: str):
-    return CtdService.get_niskins(cruise_name, cast_number)
+async def get_niskins(request, response: HttpResponse, cruise_name: str, cast_number: str, limit: Optional[int] = None, cursor: Optional[str] = None):
+    page = get_page(limit, cursor)
+    validators = await CtdService.aget_validators('niskins')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    niskins = await CtdService.aget_niskins(cruise_name, cast_number, page)
+    set_page_headers(request, response, page)
+    return render_rows(router, request, response, niskins)
 
 
 @router.get("niskins/get/{cruise_name}/{cast_number}/{niskin_number}", response=NiskinOutput)
-def get_niskin(request, cruise_name: str, cast_number: str, niskin_number: int):
-    return CtdService.get_niskin(cruise_name, cast_number, niskin_number)
+async def get_niskin(request, response: HttpResponse, cruise_name: str, cast_number: str, niskin_number: int):
+    validators = await CtdService.aget_validators('niskins')
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    return await CtdService.aget_niskin(cruise_name, cast_number, niskin_number)
 
 
 @router.post('niskins/update/{cruise_name}/{cast_number}/{niskin_number}')
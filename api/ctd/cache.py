@@ -0,0 +1,162 @@
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.caching import CacheStats, aget_version, aget_versions, bump_version, get_version, get_versions
+
+
+# Version markers for the CTD read endpoints, one per resource family.
+# Each family serializes the names of its parents and deleting a parent
+# cascades to its children, so a write to a family also bumps every family
+# after it.
+
+FAMILIES = ('vessels', 'cruises', 'casts', 'niskins')
+
+
+def get_family_version(family):
+    return get_version('ctd:' + family)
+
+
+async def aget_family_version(family):
+    return await aget_version('ctd:' + family)
+
+
+def invalidate(family):
+    for dependent in FAMILIES[FAMILIES.index(family):]:
+        bump_version('ctd:' + dependent)
+
+
+# Response cache for the cruise, cast and niskin read endpoints.
+#
+# Every entry depends on a chain of scopes, outermost first: a cruise, then
+# either the cruise's cast list or one of its casts, and so on down to a
+# single niskin. Entry keys carry the version of each scope in the chain, so
+# a write bumps only the scopes it touches (e.g. updating niskin 3 of cast 1
+# leaves cast 2 and the cruise itself cached) and the stale entries age out
+# of the cache on their own. Names are matched case-insensitively, as in the
+# queries.
+#
+# There is a marker per cruise, cast and niskin, so the scope markers are
+# kept in the response cache itself rather than with the family markers in
+# the default cache: they are culled along with the entries that use them
+# (which only invalidates those entries) and cannot push the family markers
+# out.
+
+stats = CacheStats()
+
+
+def _alias():
+    return getattr(settings, 'CTD_RESPONSE_CACHE', None)
+
+
+def _cache():
+    alias = _alias()
+    return caches[alias] if alias else None
+
+
+def _name(value):
+    return quote(str(value).lower(), safe='')
+
+
+def _scopes(resource, cruise_name, cast_number=None, niskin_number=None):
+    cruise = _name(cruise_name)
+    scopes = ['ctd:cruise:' + cruise]
+    if resource == 'casts':
+        scopes.append('ctd:casts:' + cruise)
+    elif resource in ('cast', 'niskins', 'niskin'):
+        cast = cruise + ':' + _name(cast_number)
+        scopes.append('ctd:cast:' + cast)
+        if resource == 'niskins':
+            scopes.append('ctd:niskins:' + cast)
+        elif resource == 'niskin':
+            scopes.append('ctd:niskin:' + cast + ':' + _name(niskin_number))
+    return scopes
+
+
+def _key(scopes, versions, page):
+    key = '{}:{}'.format(scopes[-1], '.'.join(str(version) for version in versions))
+    if page is not None:
+        key += ':{}:{}'.format(page.limit, page.after)
+    return key
+
+
+def _unpack(entry, page):
+    if entry is None:
+        stats.miss()
+        return None
+    stats.hit()
+    value, next_cursor = entry
+    if page is not None:
+        page.next_cursor = next_cursor
+    return value
+
+
+def _pack(value, page):
+    return value, page.next_cursor if page is not None else None
+
+
+def get_response(resource, compute, *names, page=None):
+    # compute(*names) (or compute(*names, page) for a paginated list) through
+    # the cache; errors such as a 404 propagate and are not cached
+    cache = _cache()
+    args = names if page is None else names + (page,)
+    if cache is None:
+        return compute(*args)
+    scopes = _scopes(resource, *names)
+    key = _key(scopes, get_versions(scopes, _alias()), page)
+    value = _unpack(cache.get(key), page)
+    if value is None:
+        value = compute(*args)
+        cache.set(key, _pack(value, page))
+    return value
+
+
+async def aget_response(resource, acompute, *names, page=None):
+    cache = _cache()
+    args = names if page is None else names + (page,)
+    if cache is None:
+        return await acompute(*args)
+    scopes = _scopes(resource, *names)
+    key = _key(scopes, await aget_versions(scopes, _alias()), page)
+    value = _unpack(await cache.aget(key), page)
+    if value is None:
+        value = await acompute(*args)
+        await cache.aset(key, _pack(value, page))
+    return value
+
+
+def store(resource, value, *names):
+    # Write-through: cache the output of a create or update under the
+    # current versions, so the next read of it is a hit
+    cache = _cache()
+    if cache is not None:
+        scopes = _scopes(resource, *names)
+        cache.set(_key(scopes, get_versions(scopes, _alias()), None), _pack(value, None))
+    return value
+
+
+def _bump(scope):
+    alias = _alias()
+    if alias:
+        bump_version(scope, alias)
+
+
+def invalidate_cruise(cruise_name):
+    invalidate('cruises')
+    _bump(_scopes('cruise', cruise_name)[-1])
+
+
+def invalidate_casts(cruise_name, *cast_numbers):
+    # The cruise's cast list, and each of the given casts with its niskins
+    invalidate('casts')
+    _bump(_scopes('casts', cruise_name)[-1])
+    for cast_number in cast_numbers:
+        _bump(_scopes('cast', cruise_name, cast_number)[-1])
+
+
+def invalidate_niskins(cruise_name, cast_number, *niskin_numbers):
+    invalidate('niskins')
+    _bump(_scopes('niskins', cruise_name, cast_number)[-1])
+    for niskin_number in niskin_numbers:
+        _bump(_scopes('niskin', cruise_name, cast_number, niskin_number)[-1])
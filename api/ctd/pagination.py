@@ -0,0 +1,77 @@
+import base64
+import binascii
+import json
+
+from ninja.errors import HttpError
+
+
+# Opt-in keyset (cursor) pagination for the CTD list endpoints.
+#
+# Pages are ordered by primary key and a cursor encodes the last key of the
+# previous page, so fetching any page is an index range scan of `limit` rows
+# no matter how deep it is, unlike OFFSET.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(json.dumps({'pk': pk}).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        pk = json.loads(base64.urlsafe_b64decode(padded))['pk']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HttpError(400, 'Invalid cursor')
+    if not isinstance(pk, int):
+        raise HttpError(400, 'Invalid cursor')
+    return pk
+
+
+class KeysetPage:
+    def __init__(self, limit=None, cursor=None):
+        limit = DEFAULT_LIMIT if limit is None else limit
+        if limit < 1:
+            raise HttpError(400, 'limit must be at least 1')
+        self.limit = min(limit, MAX_LIMIT)
+        self.after = decode_cursor(cursor) if cursor is not None else None
+        self.next_cursor = None
+
+    def _slice(self, queryset):
+        queryset = queryset.order_by('pk')
+        if self.after is not None:
+            queryset = queryset.filter(pk__gt=self.after)
+        # One extra row tells whether there is a next page
+        return queryset[:self.limit + 1]
+
+    def _finish(self, rows):
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self.next_cursor = encode_cursor(rows[-1].pk)
+        return rows
+
+    def paginate(self, queryset):
+        return self._finish(list(self._slice(queryset)))
+
+    async def apaginate(self, queryset):
+        return self._finish([row async for row in self._slice(queryset)])
+
+
+def get_page(limit=None, cursor=None):
+    # None (no pagination) unless the client asked for it
+    if limit is None and cursor is None:
+        return None
+    return KeysetPage(limit, cursor)
+
+
+def set_page_headers(request, response, page):
+    if page is None or page.next_cursor is None:
+        return
+    query = request.GET.copy()
+    query['cursor'] = page.next_cursor
+    query['limit'] = page.limit
+    response['X-Next-Cursor'] = page.next_cursor
+    response['Link'] = '<{}?{}>; rel="next"'.format(
+        request.build_absolute_uri(request.path), query.urlencode())
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from django.conf import settings
+
+from core.models import Cruise, Cast
+
+
+# In-process cache of cruise name -> id and (cruise name, cast number) -> id.
+#
+# Most CTD requests name a cruise and a cast, and resolving those names is
+# otherwise the first query of every request. Names match case-insensitively,
+# as in the queries, and only names that exist are remembered. Renames and
+# deletes made through CtdService evict entries in this process;
+# CTD_NAME_RESOLVER_TTL bounds how long a change made by another worker
+# process can go unseen (an id whose row was deleted just matches nothing).
+
+_cruises = {}  # cruise name -> (id, expires)
+_casts = {}  # (cruise name, cast number) -> (id, expires)
+_lock = threading.Lock()
+
+
+def _ttl():
+    return getattr(settings, 'CTD_NAME_RESOLVER_TTL', 300)
+
+
+def _get(table, key):
+    entry = table.get(key)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+
+def _put(table, key, pk):
+    table[key] = (pk, time.monotonic() + _ttl())
+    return pk
+
+
+def _cast_key(cruise_name, cast_number):
+    return cruise_name.lower(), str(cast_number).lower()
+
+
+def cruise_id(cruise_name):
+    # Raises Cruise.DoesNotExist for an unknown cruise
+    pk = _get(_cruises, cruise_name.lower())
+    if pk is None:
+        pk = Cruise.objects.values_list('id', flat=True).get(name__iexact=cruise_name)
+        _put(_cruises, cruise_name.lower(), pk)
+    return pk
+
+
+async def acruise_id(cruise_name):
+    pk = _get(_cruises, cruise_name.lower())
+    if pk is None:
+        pk = await Cruise.objects.values_list('id', flat=True).aget(name__iexact=cruise_name)
+        _put(_cruises, cruise_name.lower(), pk)
+    return pk
+
+
+def cast_id(cruise_name, cast_number):
+    # Raises Cast.DoesNotExist for an unknown cruise or cast
+    key = _cast_key(cruise_name, cast_number)
+    pk = _get(_casts, key)
+    if pk is None:
+        pk = Cast.objects.values_list('id', flat=True).get(
+            cruise__name__iexact=cruise_name, number__iexact=cast_number)
+        _put(_casts, key, pk)
+    return pk
+
+
+async def acast_id(cruise_name, cast_number):
+    key = _cast_key(cruise_name, cast_number)
+    pk = _get(_casts, key)
+    if pk is None:
+        pk = await Cast.objects.values_list('id', flat=True).aget(
+            cruise__name__iexact=cruise_name, number__iexact=cast_number)
+        _put(_casts, key, pk)
+    return pk
+
+
+def forget_cruise(cruise_name):
+    # Also forgets the cruise's casts, which a delete cascades to
+    name = cruise_name.lower()
+    with _lock:
+        _cruises.pop(name, None)
+        for key in list(_casts):
+            if key[0] == name:
+                _casts.pop(key, None)
+
+
+def forget_cast(cruise_name, cast_number):
+    with _lock:
+        _casts.pop(_cast_key(cruise_name, cast_number), None)
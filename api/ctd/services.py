@@ -6,9 +6,14 @@ from django.contrib.gis.geos import Point, point
 
 from pydantic import BaseModel
 
+from core.conditional import Validators, validators
 from core.models import Vessel, Cruise, Cast, Niskin
 
-from django.db import IntegrityError
+from . import cache as ctd_cache
+from . import resolver
+from .pagination import KeysetPage
+
+from django.db import IntegrityError, connection, transaction
 from django.http import Http404
 from ninja.errors import HttpError
 
@@ -92,7 +97,8 @@ class NiskinOutput(BaseModel):
     cruise_name: str
     cast_number: str
     number: int
-    geolocation: Tuple[float, float]
+    # None for a niskin stored without a location
+    geolocation: Optional[Tuple[float, float]] = None
     depth: float
     
 
@@ -101,8 +107,56 @@ class UpdateNiskinInput(BaseModel):
     longitude: Optional[float] = None
     depth: float
 
+
+class BulkNiskinInput(BaseModel):
+    number: int
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    depth: float
+
+
+class BulkCastInput(BaseModel):
+    number: str
+    latitude: float
+    longitude: float
+    depth: float
+    start_time: datetime
+    end_time: Optional[datetime] = None
+    niskins: List[BulkNiskinInput] = []
+
+
+class BulkCruiseInput(BaseModel):
+    casts: List[BulkCastInput]
+
+
+class BulkConflict(BaseModel):
+    cast_number: str
+    niskin_number: Optional[int] = None
+    message: str
+
+
+class BulkCruiseOutput(BaseModel):
+    cruise_name: str
+    casts_created: int
+    casts_updated: int
+    niskins_created: int
+    niskins_updated: int
+    conflicts: List[BulkConflict]
+
     
 class CtdService:
+    @staticmethod
+    def get_validators(family: str) -> Validators:
+        return validators('ctd-' + family, ctd_cache.get_family_version(family))
+
+    @staticmethod
+    async def aget_validators(family: str) -> Validators:
+        return validators('ctd-' + family, await ctd_cache.aget_family_version(family))
+
+    @staticmethod
+    def get_cache_stats() -> dict:
+        return ctd_cache.stats.as_dict()
+
     
     @staticmethod
     def serialize_vessel(vessel: Vessel) -> VesselOutput:
@@ -113,12 +167,31 @@ class CtdService:
                 code=vessel.code
         )
 
+    @staticmethod
+    def vessel_row(vessel: Vessel) -> dict:
+        # VesselOutput as a plain dict, for the list endpoints
+        return {
+            'designation': vessel.designation,
+            'name': vessel.name,
+            'short_name': vessel.short_name,
+            'code': vessel.code,
+        }
+
 
     @classmethod
-    def get_vessels(cls) -> list[VesselOutput]:
+    def get_vessels(cls, page: KeysetPage = None) -> list[dict]:
         vessels = Vessel.objects.all()
-        return [cls.serialize_vessel(vessel) for vessel in vessels]
+        if page is not None:
+            vessels = page.paginate(vessels)
+        return [cls.vessel_row(vessel) for vessel in vessels]
  
+
+    @classmethod
+    async def aget_vessels(cls, page: KeysetPage = None) -> list[dict]:
+        vessels = Vessel.objects.all()
+        if page is not None:
+            return [cls.vessel_row(vessel) for vessel in await page.apaginate(vessels)]
+        return [cls.vessel_row(vessel) async for vessel in vessels]
     
     @classmethod
     def get_vessel(cls, vessel_name: str) -> VesselOutput:
@@ -129,6 +202,14 @@ class CtdService:
             raise Http404(f"Vessel {vessel_name} not found.")
 
 
+    @classmethod
+    async def aget_vessel(cls, vessel_name: str) -> VesselOutput:
+        try:
+            vessel = await Vessel.objects.aget(name__iexact=vessel_name)
+            return cls.serialize_vessel(vessel)
+        except Vessel.DoesNotExist:
+            raise Http404(f"Vessel {vessel_name} not found.")
+
     @classmethod
     def create_vessel(cls, input: AddVesselInput) -> VesselOutput:
         try:
@@ -142,6 +223,7 @@ class CtdService:
                     short_name=input.short_name,
                     code=input.code
                 )            
+                ctd_cache.invalidate('vessels')
                 return cls.serialize_vessel(new_vessel)
             except IntegrityError as e:
                 if 'duplicate key value violates unique constraint' in str(e):
@@ -165,6 +247,7 @@ class CtdService:
                 vessel.short_name=input.short_name
                 vessel.code=input.code
                 vessel.save()
+                ctd_cache.invalidate('vessels')
                 return cls.serialize_vessel(vessel)
             except IntegrityError as e:
                 if 'duplicate key value violates unique constraint' in str(e):
@@ -187,15 +270,49 @@ class CtdService:
             end_time=cruise.end_time,
         )
 
+    @staticmethod
+    def cruise_row(cruise: Cruise) -> dict:
+        return {
+            'name': cruise.name,
+            'vessel_name': cruise.vessel.name,
+            'start_time': cruise.start_time,
+            'end_time': cruise.end_time,
+        }
+
+    @classmethod
+    def get_cruises(cls, page: KeysetPage = None) -> list[dict]:
+        cruises = Cruise.objects.select_related('vessel')
+        if page is not None:
+            cruises = page.paginate(cruises)
+        return [cls.cruise_row(cruise) for cruise in cruises]
+
     @classmethod
-    def get_cruises(cls) -> list[CruiseOutput]:
-        cruises = Cruise.objects.all()
-        return [cls.serialize_cruise(cruise) for cruise in cruises]
+    async def aget_cruises(cls, page: KeysetPage = None) -> list[dict]:
+        cruises = Cruise.objects.select_related('vessel')
+        if page is not None:
+            return [cls.cruise_row(cruise) for cruise in await page.apaginate(cruises)]
+        return [cls.cruise_row(cruise) async for cruise in cruises]
     
     @classmethod
     def get_cruise(cls, cruise_name: str) -> CruiseOutput:
+        return ctd_cache.get_response('cruise', cls.compute_cruise, cruise_name)
+
+    @classmethod
+    def compute_cruise(cls, cruise_name: str) -> CruiseOutput:
         try:
-            cruise = Cruise.objects.get(name__iexact=cruise_name)  # Case-insensitive search
+            cruise = Cruise.objects.select_related('vessel').get(name__iexact=cruise_name)  # Case-insensitive search
+            return cls.serialize_cruise(cruise)
+        except Cruise.DoesNotExist:
+            raise Http404(f"Cruise {cruise_name} not found.")
+
+    @classmethod
+    async def aget_cruise(cls, cruise_name: str) -> CruiseOutput:
+        return await ctd_cache.aget_response('cruise', cls.acompute_cruise, cruise_name)
+
+    @classmethod
+    async def acompute_cruise(cls, cruise_name: str) -> CruiseOutput:
+        try:
+            cruise = await Cruise.objects.select_related('vessel').aget(name__iexact=cruise_name)
             return cls.serialize_cruise(cruise)
         except Cruise.DoesNotExist:
             raise Http404(f"Cruise {cruise_name} not found.")
@@ -210,7 +327,8 @@ class CtdService:
                 start_time=input.start_time,
                 end_time=input.end_time
             )            
-            return cls.serialize_cruise(new_cruise)
+            ctd_cache.invalidate_cruise(new_cruise.name)
+            return ctd_cache.store('cruise', cls.serialize_cruise(new_cruise), new_cruise.name)
         except IntegrityError:
             raise HttpError(409, f"error': f'Cruise with name {input.name} already exists.")
         except Vessel.DoesNotExist:
@@ -228,7 +346,8 @@ class CtdService:
                 cruise.start_time = input.start_time
                 cruise.end_time = input.end_time
                 cruise.save()
-                return cls.serialize_cruise(cruise)
+                ctd_cache.invalidate_cruise(cruise_name)
+                return ctd_cache.store('cruise', cls.serialize_cruise(cruise), cruise_name)
             except Vessel.DoesNotExist:
                 raise Http404(f"Vessel with name {input.vessel_name} not found.")
         except Cruise.DoesNotExist:
@@ -239,6 +358,8 @@ class CtdService:
         try:
            cruise = Cruise.objects.get(name__iexact=cruise_name)
            cruise.delete()
+           resolver.forget_cruise(cruise_name)
+           ctd_cache.invalidate_cruise(cruise_name)
            return {"status": "success", "message": f"Cruise {cruise_name} deleted."}   
         except Cruise.DoesNotExist:
             raise HttpError(404, f"Cruise {cruise_name} not found.")
@@ -255,28 +376,116 @@ class CtdService:
                 end_time=cast.end_time
         )
 
+    @staticmethod
+    def cast_row(cast: Cast) -> dict:
+        return {
+            'cruise_name': cast.cruise.name,
+            'number': cast.number,
+            'geolocation': cast.geolocation.coords,
+            'depth': cast.depth,
+            'start_time': cast.start_time,
+            'end_time': cast.end_time,
+        }
+
+
+    @classmethod
+    def get_casts(cls, cruise_name: str, page: KeysetPage = None) -> List[dict]:
+        return ctd_cache.get_response('casts', cls.compute_casts, cruise_name, page=page)
+
+    # The list paths filter on an id remembered by the resolver, which another
+    # process may have deleted (or renamed) since. That would silently give an
+    # empty or wrong list, and the list is cached for every worker, so a
+    # result is only kept once it shows the id still names the cruise or
+    # cast: by the names on its rows, or when it is empty by one more query.
+    # Otherwise the id is forgotten and resolved again.
+
+    @staticmethod
+    def _fetch_casts(cruise_id: int, page: KeysetPage = None) -> list:
+        casts = Cast.objects.filter(cruise_id=cruise_id).select_related('cruise')
+        if page is not None:
+            page.next_cursor = None
+            return page.paginate(casts)
+        return list(casts)
 
     @staticmethod
-    def get_casts(cruise_name: str) -> List[CastOutput]:
+    async def _afetch_casts(cruise_id: int, page: KeysetPage = None) -> list:
+        casts = Cast.objects.filter(cruise_id=cruise_id).select_related('cruise')
+        if page is not None:
+            page.next_cursor = None
+            return await page.apaginate(casts)
+        return [cast async for cast in casts]
+
+    @staticmethod
+    def _casts_match(casts: list, cruise_name: str) -> Optional[bool]:
+        # None when there are no rows to tell
+        if not casts:
+            return None
+        return casts[0].cruise.name.lower() == cruise_name.lower()
+
+    @staticmethod
+    def compute_casts(cruise_name: str, page: KeysetPage = None) -> List[dict]:
         try:
-            cruise = Cruise.objects.get(name__iexact=cruise_name)
-            casts = Cast.objects.filter(cruise=cruise)
-            return [CtdService.serialize_cast(cast) for cast in casts]
+            cruise_id = resolver.cruise_id(cruise_name)
+            casts = CtdService._fetch_casts(cruise_id, page)
+            match = CtdService._casts_match(casts, cruise_name)
+            if match is None:
+                match = Cruise.objects.filter(pk=cruise_id, name__iexact=cruise_name).exists()
+            if not match:
+                resolver.forget_cruise(cruise_name)
+                casts = CtdService._fetch_casts(resolver.cruise_id(cruise_name), page)
+            return [CtdService.cast_row(cast) for cast in casts]
         except Cruise.DoesNotExist:
             raise Http404(f"Cruise {cruise_name} not found.")
+
+    @classmethod
+    async def aget_casts(cls, cruise_name: str, page: KeysetPage = None) -> List[dict]:
+        return await ctd_cache.aget_response('casts', cls.acompute_casts, cruise_name, page=page)
+
+    @staticmethod
+    async def acompute_casts(cruise_name: str, page: KeysetPage = None) -> List[dict]:
+        try:
+            cruise_id = await resolver.acruise_id(cruise_name)
+            casts = await CtdService._afetch_casts(cruise_id, page)
+            match = CtdService._casts_match(casts, cruise_name)
+            if match is None:
+                match = await Cruise.objects.filter(pk=cruise_id, name__iexact=cruise_name).aexists()
+            if not match:
+                resolver.forget_cruise(cruise_name)
+                casts = await CtdService._afetch_casts(await resolver.acruise_id(cruise_name), page)
+            return [CtdService.cast_row(cast) for cast in casts]
+        except Cruise.DoesNotExist:
+            raise Http404(f"Cruise {cruise_name} not found.")
+
+        
+    @classmethod
+    def get_cast(cls, cruise_name: str, cast_number: str) -> CastOutput:
+        return ctd_cache.get_response('cast', cls.compute_cast, cruise_name, cast_number)
+
+    @staticmethod
+    def compute_cast(cruise_name: str, cast_number: str) -> CastOutput:
+        try:
+            cast = Cast.objects.select_related('cruise').get(pk=resolver.cast_id(cruise_name, cast_number))
+            return CtdService.serialize_cast(cast)
         except Cast.DoesNotExist:
+            resolver.forget_cast(cruise_name, cast_number)
+            if not Cruise.objects.filter(name__iexact=cruise_name).exists():
+                raise Http404(f"Cruise {cruise_name} not found.")
             raise Http404(f"Cast not found for {cruise_name} .")
 
-        
+    @classmethod
+    async def aget_cast(cls, cruise_name: str, cast_number: str) -> CastOutput:
+        return await ctd_cache.aget_response('cast', cls.acompute_cast, cruise_name, cast_number)
+
     @staticmethod
-    def get_cast(cruise_name: str, cast_number: str) -> CastOutput:
+    async def acompute_cast(cruise_name: str, cast_number: str) -> CastOutput:
         try:
-            cruise = Cruise.objects.get(name__iexact=cruise_name)
-            cast = Cast.objects.get(cruise=cruise, number__iexact=cast_number)
+            cast_id = await resolver.acast_id(cruise_name, cast_number)
+            cast = await Cast.objects.select_related('cruise').aget(pk=cast_id)
             return CtdService.serialize_cast(cast)
-        except Cruise.DoesNotExist:
-            raise Http404(f"Cruise {cruise_name} not found.")
         except Cast.DoesNotExist:
+            resolver.forget_cast(cruise_name, cast_number)
+            if not await Cruise.objects.filter(name__iexact=cruise_name).aexists():
+                raise Http404(f"Cruise {cruise_name} not found.")
             raise Http404(f"Cast not found for {cruise_name} .")
         
 
@@ -295,7 +504,9 @@ class CtdService:
                         depth=cast_input.depth,
                         start_time=cast_input.start_time,
                         end_time=cast_input.end_time)
-                    return cls.serialize_cast(cast)
+                    ctd_cache.invalidate_casts(cast_input.cruise_name)
+                    return ctd_cache.store(
+                        'cast', cls.serialize_cast(cast), cast_input.cruise_name, cast_input.number)
                 except IntegrityError as e:
                     if 'unique_cruise_cast_number' in str(e):
                         raise HttpError(409, f"Cast {cast_input.number} already exists.")
@@ -307,7 +518,7 @@ class CtdService:
     def update_cast(cls, cruise_name: str, cast_number: str, cast_input: UpdateCastInput) -> CastOutput:
         try:
             cruise = Cruise.objects.get(name__iexact=cruise_name)
-            cast = Cast.objects.get(cruise=cruise, number=cast_number)
+            cast = Cast.objects.select_related('cruise').get(cruise=cruise, number=cast_number)
             location = None
             if cast_input.latitude is not None and cast_input.longitude is not None:
                 location = Point(cast_input.longitude, cast_input.latitude, srid=4326)
@@ -316,7 +527,8 @@ class CtdService:
                 cast.start_time=cast_input.start_time
                 cast.end_time=cast_input.end_time
                 cast.save()
-                return cls.serialize_cast(cast)
+                ctd_cache.invalidate_casts(cruise_name, cast_number)
+                return ctd_cache.store('cast', cls.serialize_cast(cast), cruise_name, cast_number)
         except Cruise.DoesNotExist:
             raise Http404(f"Cruise {cast_input.cruise_name} not found.")
         except Cast.DoesNotExist:
@@ -328,6 +540,8 @@ class CtdService:
             cruise = Cruise.objects.get(name__iexact=cruise_name)
             cast = Cast.objects.get(cruise=cruise, number__iexact=cast_number)
             cast.delete()
+            resolver.forget_cast(cruise_name, cast_number)
+            ctd_cache.invalidate_casts(cruise_name, cast_number)
             return {"status": "success", "message": f"Cast {cast_number} on cruise {cruise_name} deleted."}   
         except Cruise.DoesNotExist:
             raise Http404(f"Cruise {cruise_name} not found.")
@@ -345,12 +559,22 @@ class CtdService:
                 geolocation=niskin.geolocation
         )
 
+    @staticmethod
+    def niskin_row(niskin: Niskin) -> dict:
+        return {
+            'cruise_name': niskin.cast.cruise.name,
+            'cast_number': niskin.cast.number,
+            'number': niskin.number,
+            'geolocation': niskin.geolocation.coords if niskin.geolocation is not None else None,
+            'depth': niskin.depth,
+        }
+
 
     @classmethod
     def create_niskin(cls, niskin_input: NiskinInput) -> NiskinOutput:
         try:
             cruise = Cruise.objects.get(name__iexact=niskin_input.cruise_name)
-            cast = Cast.objects.get(cruise=cruise, number__iexact=niskin_input.cast_number)
+            cast = Cast.objects.select_related('cruise').get(cruise=cruise, number__iexact=niskin_input.cast_number)
             location = None
             if niskin_input.latitude is not None and niskin_input.longitude is not None:
                 location = Point(niskin_input.longitude, niskin_input.latitude, srid=4326)
@@ -360,7 +584,10 @@ class CtdService:
                         number=niskin_input.number,
                         geolocation=location,
                         depth=niskin_input.depth)
-                    return cls.serialize_niskin(niskin)
+                    ctd_cache.invalidate_niskins(niskin_input.cruise_name, niskin_input.cast_number)
+                    return ctd_cache.store(
+                        'niskin', cls.serialize_niskin(niskin),
+                        niskin_input.cruise_name, niskin_input.cast_number, niskin_input.number)
                 except IntegrityError as e:
                     if 'unique_cast_niskin_number' in str(e):
                         raise HttpError(409, f"Niskin {niskin_input.number} already exists.")
@@ -370,29 +597,109 @@ class CtdService:
             raise Http404(f"Cast not found for {niskin_input.cruise_name} .")
     
 
+    @classmethod
+    def get_niskins(cls, cruise_name: str, cast_number: str, page: KeysetPage = None) -> List[dict]:
+        return ctd_cache.get_response('niskins', cls.compute_niskins, cruise_name, cast_number, page=page)
+
     @staticmethod
-    def get_niskins(cruise_name: str, cast_number: str ) -> List[NiskinOutput]:
+    def _fetch_niskins(cast_id: int, page: KeysetPage = None) -> list:
+        niskins = Niskin.objects.filter(cast_id=cast_id).select_related('cast__cruise')
+        if page is not None:
+            page.next_cursor = None
+            return page.paginate(niskins)
+        return list(niskins)
+
+    @staticmethod
+    async def _afetch_niskins(cast_id: int, page: KeysetPage = None) -> list:
+        niskins = Niskin.objects.filter(cast_id=cast_id).select_related('cast__cruise')
+        if page is not None:
+            page.next_cursor = None
+            return await page.apaginate(niskins)
+        return [niskin async for niskin in niskins]
+
+    @staticmethod
+    def _niskins_match(niskins: list, cruise_name: str, cast_number: str) -> Optional[bool]:
+        if not niskins:
+            return None
+        cast = niskins[0].cast
+        return cast.cruise.name.lower() == cruise_name.lower() and cast.number.lower() == str(cast_number).lower()
+
+    @staticmethod
+    def _cast_query(cast_id: int, cruise_name: str, cast_number: str):
+        return Cast.objects.filter(pk=cast_id, cruise__name__iexact=cruise_name, number__iexact=cast_number)
+
+    @staticmethod
+    def compute_niskins(cruise_name: str, cast_number: str, page: KeysetPage = None) -> List[dict]:
         try:
-            cruise = Cruise.objects.get(name__iexact=cruise_name)
-            cast = Cast.objects.get(cruise=cruise, number__iexact=cast_number)
-            niskins = Niskin.objects.filter(cast=cast)
-            return [CtdService.serialize_niskin(niskin) for niskin in niskins]
-        except Cruise.DoesNotExist:
-            raise Http404(f"Cruise {cruise_name} not found.")
+            cast_id = resolver.cast_id(cruise_name, cast_number)
+            niskins = CtdService._fetch_niskins(cast_id, page)
+            match = CtdService._niskins_match(niskins, cruise_name, cast_number)
+            if match is None:
+                match = CtdService._cast_query(cast_id, cruise_name, cast_number).exists()
+            if not match:
+                resolver.forget_cast(cruise_name, cast_number)
+                niskins = CtdService._fetch_niskins(resolver.cast_id(cruise_name, cast_number), page)
+            return [CtdService.niskin_row(niskin) for niskin in niskins]
         except Cast.DoesNotExist:
+            if not Cruise.objects.filter(name__iexact=cruise_name).exists():
+                raise Http404(f"Cruise {cruise_name} not found.")
             raise Http404(f"Cast not found for cruise {cruise_name} .")
 
+    @classmethod
+    async def aget_niskins(cls, cruise_name: str, cast_number: str, page: KeysetPage = None) -> List[dict]:
+        return await ctd_cache.aget_response('niskins', cls.acompute_niskins, cruise_name, cast_number, page=page)
 
     @staticmethod
-    def get_niskin(cruise_name: str, cast_number: str, niskin_number: int) -> NiskinOutput:
+    async def acompute_niskins(cruise_name: str, cast_number: str, page: KeysetPage = None) -> List[dict]:
         try:
-            cruise = Cruise.objects.get(name__iexact=cruise_name)
-            cast = Cast.objects.get(cruise=cruise, number__iexact=cast_number)
-            niskin = Niskin.objects.get(cast=cast, number=niskin_number)
+            cast_id = await resolver.acast_id(cruise_name, cast_number)
+            niskins = await CtdService._afetch_niskins(cast_id, page)
+            match = CtdService._niskins_match(niskins, cruise_name, cast_number)
+            if match is None:
+                match = await CtdService._cast_query(cast_id, cruise_name, cast_number).aexists()
+            if not match:
+                resolver.forget_cast(cruise_name, cast_number)
+                niskins = await CtdService._afetch_niskins(await resolver.acast_id(cruise_name, cast_number), page)
+            return [CtdService.niskin_row(niskin) for niskin in niskins]
+        except Cast.DoesNotExist:
+            if not await Cruise.objects.filter(name__iexact=cruise_name).aexists():
+                raise Http404(f"Cruise {cruise_name} not found.")
+            raise Http404(f"Cast not found for cruise {cruise_name} .")
+
+
+    @classmethod
+    def get_niskin(cls, cruise_name: str, cast_number: str, niskin_number: int) -> NiskinOutput:
+        return ctd_cache.get_response('niskin', cls.compute_niskin, cruise_name, cast_number, niskin_number)
+
+    @staticmethod
+    def compute_niskin(cruise_name: str, cast_number: str, niskin_number: int) -> NiskinOutput:
+        try:
+            niskin = Niskin.objects.select_related('cast__cruise').get(
+                cast_id=resolver.cast_id(cruise_name, cast_number), number=niskin_number)
+            return CtdService.serialize_niskin(niskin)
+        except Cast.DoesNotExist:
+            resolver.forget_cast(cruise_name, cast_number)
+            # Only on a miss: find out which part of the path does not exist
+            if not Cruise.objects.filter(name__iexact=cruise_name).exists():
+                raise Http404(f"Cruise {cruise_name} not found.")
+            raise Http404(f"Cast not found for cruise {cruise_name} .")
+        except Niskin.DoesNotExist:
+            raise Http404(f"Niskin not found for cruise {cruise_name} cast {cast_number} .")
+
+    @classmethod
+    async def aget_niskin(cls, cruise_name: str, cast_number: str, niskin_number: int) -> NiskinOutput:
+        return await ctd_cache.aget_response('niskin', cls.acompute_niskin, cruise_name, cast_number, niskin_number)
+
+    @staticmethod
+    async def acompute_niskin(cruise_name: str, cast_number: str, niskin_number: int) -> NiskinOutput:
+        try:
+            cast_id = await resolver.acast_id(cruise_name, cast_number)
+            niskin = await Niskin.objects.select_related('cast__cruise').aget(cast_id=cast_id, number=niskin_number)
             return CtdService.serialize_niskin(niskin)
-        except Cruise.DoesNotExist:
-            raise Http404(f"Cruise {cruise_name} not found.")
         except Cast.DoesNotExist:
+            resolver.forget_cast(cruise_name, cast_number)
+            if not await Cruise.objects.filter(name__iexact=cruise_name).aexists():
+                raise Http404(f"Cruise {cruise_name} not found.")
             raise Http404(f"Cast not found for cruise {cruise_name} .")
         except Niskin.DoesNotExist:
             raise Http404(f"Niskin not found for cruise {cruise_name} cast {cast_number} .")
@@ -403,14 +710,16 @@ class CtdService:
         try:
             cruise = Cruise.objects.get(name__iexact=cruise_name)
             cast = Cast.objects.get(cruise=cruise, number__iexact=cast_number)
-            niskin = Niskin.objects.get(cast=cast, number=niskin_number)
+            niskin = Niskin.objects.select_related('cast__cruise').get(cast=cast, number=niskin_number)
             location = None
             if niskin_input.latitude is not None and niskin_input.longitude is not None:
                 location = Point(niskin_input.longitude, niskin_input.latitude, srid=4326)
                 niskin.geolocation=location
                 niskin.depth=niskin_input.depth
                 niskin.save()
-                return cls.serialize_niskin(niskin)
+                ctd_cache.invalidate_niskins(cruise_name, cast_number, niskin_number)
+                return ctd_cache.store(
+                    'niskin', cls.serialize_niskin(niskin), cruise_name, cast_number, niskin_number)
         except Cruise.DoesNotExist:
             raise Http404(f"Cruise {cruise_name} not found.")
         except Cast.DoesNotExist:
@@ -425,6 +734,7 @@ class CtdService:
             cast = Cast.objects.get(cruise=cruise, number__iexact=cast_number)
             niskin = Niskin.objects.get(cast=cast, number=niskin_number)
             niskin.delete()
+            ctd_cache.invalidate_niskins(cruise_name, cast_number, niskin_number)
             return {"status": "success", "message": f"Cast {cast_number} on cruise {cruise_name} deleted."}   
         except Cruise.DoesNotExist:
             raise Http404(f"Cruise {cruise_name} not found.")
@@ -432,3 +742,115 @@ class CtdService:
             raise Http404(f"Cast not found for cruise {cruise_name} .")
         except Niskin.DoesNotExist:
             raise Http404(f"Niskin not found for cruise {cruise_name} cast {cast_number} .")
+
+
+    @classmethod
+    def ingest_cruise(cls, cruise_name: str, bulk_input: BulkCruiseInput) -> BulkCruiseOutput:
+        # Upserts a cruise's casts and their niskins in one transaction. Names
+        # are resolved once; rows that cannot be written are reported as
+        # conflicts and skipped instead of aborting the whole load.
+        try:
+            cruise = Cruise.objects.get(name__iexact=cruise_name)
+        except Cruise.DoesNotExist:
+            raise Http404(f"Cruise {cruise_name} not found.")
+
+        conflicts = []
+
+        # Cast numbers match case-insensitively, as in the single-row endpoints,
+        # so an existing cast keeps its stored spelling
+        existing_casts = {
+            number.lower(): number
+            for number in Cast.objects.filter(cruise=cruise).values_list('number', flat=True)
+        }
+        # Checked here, as the database would reject the whole load over them
+        max_cast_number = Cast._meta.get_field('number').max_length
+        min_niskin_number, max_niskin_number = connection.ops.integer_field_range(
+            Niskin._meta.get_field('number').get_internal_type())
+
+        casts = {}
+        for cast_input in bulk_input.casts:
+            key = cast_input.number.lower()
+            if len(cast_input.number) > max_cast_number:
+                conflicts.append(BulkConflict(
+                    cast_number=cast_input.number,
+                    message=f"Cast number is longer than {max_cast_number} characters."))
+                continue
+            if key in casts:
+                conflicts.append(BulkConflict(
+                    cast_number=cast_input.number,
+                    message=f"Cast {cast_input.number} appears more than once."))
+                continue
+            cast = Cast(
+                cruise=cruise,
+                number=existing_casts.get(key, cast_input.number),
+                geolocation=Point(cast_input.longitude, cast_input.latitude, srid=4326),
+                depth=cast_input.depth,
+                start_time=cast_input.start_time,
+                end_time=cast_input.end_time)
+            casts[key] = (cast, cast_input)
+
+        with transaction.atomic():
+            Cast.objects.bulk_create(
+                [cast for cast, _ in casts.values()],
+                update_conflicts=True,
+                unique_fields=['cruise', 'number'],
+                update_fields=['geolocation', 'depth', 'start_time', 'end_time'],
+                batch_size=1000)
+            cast_ids = dict(
+                Cast.objects
+                .filter(cruise=cruise, number__in=[cast.number for cast, _ in casts.values()])
+                .values_list('number', 'id'))
+            existing_niskins = set(
+                Niskin.objects.filter(cast_id__in=cast_ids.values()).values_list('cast_id', 'number'))
+
+            niskins = []
+            niskins_updated = 0
+            for cast, cast_input in casts.values():
+                numbers = set()
+                for niskin_input in cast_input.niskins:
+                    if niskin_input.number in numbers:
+                        conflicts.append(BulkConflict(
+                            cast_number=cast.number,
+                            niskin_number=niskin_input.number,
+                            message=f"Niskin {niskin_input.number} appears more than once."))
+                        continue
+                    if not min_niskin_number <= niskin_input.number <= max_niskin_number:
+                        conflicts.append(BulkConflict(
+                            cast_number=cast.number,
+                            niskin_number=niskin_input.number,
+                            message=f"Niskin number must be between {min_niskin_number} and {max_niskin_number}."))
+                        continue
+                    if (niskin_input.latitude is None) != (niskin_input.longitude is None):
+                        conflicts.append(BulkConflict(
+                            cast_number=cast.number,
+                            niskin_number=niskin_input.number,
+                            message="latitude and longitude must be given together."))
+                        continue
+                    numbers.add(niskin_input.number)
+                    location = None
+                    if niskin_input.latitude is not None:
+                        location = Point(niskin_input.longitude, niskin_input.latitude, srid=4326)
+                    cast_id = cast_ids[cast.number]
+                    niskins_updated += (cast_id, niskin_input.number) in existing_niskins
+                    niskins.append(Niskin(
+                        cast_id=cast_id,
+                        number=niskin_input.number,
+                        geolocation=location,
+                        depth=niskin_input.depth))
+
+            Niskin.objects.bulk_create(
+                niskins,
+                update_conflicts=True,
+                unique_fields=['cast', 'number'],
+                update_fields=['geolocation', 'depth'],
+                batch_size=1000)
+        ctd_cache.invalidate_casts(cruise.name, *(cast.number for cast, _ in casts.values()))
+
+        casts_updated = sum(key in existing_casts for key in casts)
+        return BulkCruiseOutput(
+            cruise_name=cruise.name,
+            casts_created=len(casts) - casts_updated,
+            casts_updated=casts_updated,
+            niskins_created=len(niskins) - niskins_updated,
+            niskins_updated=niskins_updated,
+            conflicts=conflicts)
@@ -1,3 +1,248 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
 from django.test import TestCase
 
-# Create your tests here.
+from core.models import Vessel, Cruise, Cast, Niskin
+from ctd import cache as ctd_cache, resolver
+
+
+START = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class IngestCruiseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vessel = Vessel.objects.create(designation='R/V', name='Neil Armstrong', short_name='Armstrong', code='AR')
+        Cruise.objects.create(name='AR001', vessel=vessel, start_time=START, end_time=START)
+
+    def cast(self, number, niskins=()):
+        return {
+            'number': number,
+            'latitude': 41.0,
+            'longitude': -70.5,
+            'depth': 100.0,
+            'start_time': '2020-01-01T00:00:00Z',
+            'niskins': [{'number': niskin, 'depth': 10.0} for niskin in niskins],
+        }
+
+    def test_invalid_rows_are_conflicts(self):
+        response = self.client.post('/api/ctd/casts/bulk/AR001', {
+            'casts': [
+                self.cast('1', niskins=[1, -1, 2147483648]),
+                self.cast('x' * 33),
+            ],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['casts_created'], 1)
+        self.assertEqual(result['niskins_created'], 1)
+        self.assertEqual(
+            sorted((conflict['cast_number'], conflict['niskin_number']) for conflict in result['conflicts']),
+            [('1', -1), ('1', 2147483648), ('x' * 33, None)])
+        self.assertEqual(Cast.objects.count(), 1)
+        self.assertEqual(Niskin.objects.count(), 1)
+
+
+class CtdQueryCountTests(TestCase):
+    # Query counts must not grow with the number of rows returned
+
+    @classmethod
+    def setUpTestData(cls):
+        location = Point(-70.5, 41.0, srid=4326)
+        vessels = [
+            Vessel.objects.create(designation='R/V', name='Vessel{}'.format(i), short_name='V{}'.format(i), code=str(i))
+            for i in range(3)
+        ]
+        for i in range(4):
+            Cruise.objects.create(name='AR00{}'.format(i), vessel=vessels[i % 3], start_time=START, end_time=START)
+        cruise = Cruise.objects.get(name='AR000')
+        for i in range(5):
+            cast = Cast.objects.create(
+                cruise=cruise, number=str(i + 1), depth=100, geolocation=location, start_time=START)
+            for number in range(1, 7):
+                Niskin.objects.create(cast=cast, number=number, depth=number * 10, geolocation=location)
+
+    def setUp(self):
+        # Cold response caches and name resolver, so every name is looked up
+        for alias in ('default', 'ctd'):
+            caches[alias].clear()
+        resolver._cruises.clear()
+        resolver._casts.clear()
+
+    def assertQueries(self, url, count, rows=None):
+        with self.assertNumQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if rows is not None:
+            self.assertEqual(len(response.json()), rows)
+
+    def test_vessels(self):
+        self.assertQueries('/api/ctd/vessels/get/all', 1, rows=3)
+        self.assertQueries('/api/ctd/vessels/get/vessel1', 1)
+
+    def test_cruises(self):
+        self.assertQueries('/api/ctd/cruises/get/all', 1, rows=4)
+        self.assertQueries('/api/ctd/cruises/get/ar000', 1)
+
+    def test_casts(self):
+        # Resolving the cruise name, then the casts
+        self.assertQueries('/api/ctd/casts/get/AR000', 2, rows=5)
+        self.assertQueries('/api/ctd/cast/get/AR000/3', 2)
+
+    def test_niskins(self):
+        self.assertQueries('/api/ctd/niskins/get/all/AR000/1', 2, rows=6)
+        # The cast id is remembered by now
+        self.assertQueries('/api/ctd/niskins/get/AR000/1/4', 1)
+
+    def test_cached_responses(self):
+        for url in ('/api/ctd/casts/get/AR000', '/api/ctd/niskins/get/all/AR000/2'):
+            self.client.get(url)
+            self.assertQueries(url, 0)
+
+
+class NiskinWithoutLocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        vessel = Vessel.objects.create(designation='R/V', name='Neil Armstrong', short_name='Armstrong', code='AR')
+        cruise = Cruise.objects.create(name='AR001', vessel=vessel, start_time=START, end_time=START)
+        cast = Cast.objects.create(
+            cruise=cruise, number='1', depth=100, geolocation=Point(-70.5, 41.0, srid=4326), start_time=START)
+        Niskin.objects.create(cast=cast, number=1, depth=10)
+
+    def setUp(self):
+        for alias in ('default', 'ctd'):
+            caches[alias].clear()
+        resolver._cruises.clear()
+        resolver._casts.clear()
+
+    def test_list_and_detail(self):
+        niskins = self.client.get('/api/ctd/niskins/get/all/AR001/1').json()
+        self.assertIsNone(niskins[0]['geolocation'])
+        niskin = self.client.get('/api/ctd/niskins/get/AR001/1/1').json()
+        self.assertIsNone(niskin['geolocation'])
+
+    def test_schema_allows_null(self):
+        schema = self.client.get('/api/openapi.json').json()['components']['schemas']['NiskinOutput']
+        self.assertNotIn('geolocation', schema.get('required', []))
+
+
+class StaleResolverTests(TestCase):
+    # Another worker deletes and recreates a cruise: its writes bump the
+    # shared versions, but this process still remembers the old ids
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vessel = Vessel.objects.create(designation='R/V', name='Neil Armstrong', short_name='Armstrong', code='AR')
+        cls.create_cruise(cls.vessel, casts=2)
+
+    @staticmethod
+    def create_cruise(vessel, casts):
+        cruise = Cruise.objects.create(name='AR001', vessel=vessel, start_time=START, end_time=START)
+        for i in range(casts):
+            cast = Cast.objects.create(
+                cruise=cruise, number=str(i + 1), depth=100, geolocation=Point(-70.5, 41.0, srid=4326),
+                start_time=START)
+            Niskin.objects.create(cast=cast, number=1, depth=10 * (i + 1))
+        return cruise
+
+    def setUp(self):
+        for alias in ('default', 'ctd'):
+            caches[alias].clear()
+        resolver._cruises.clear()
+        resolver._casts.clear()
+
+    def recreate_elsewhere(self, casts):
+        Cruise.objects.filter(name='AR001').delete()
+        if casts is not None:
+            self.create_cruise(self.vessel, casts)
+        ctd_cache.invalidate_cruise('AR001')
+        ctd_cache.invalidate_casts('AR001', '1', '2', '3')
+
+    def test_recreated_cruise_lists_new_casts(self):
+        self.assertEqual(len(self.client.get('/api/ctd/casts/get/AR001').json()), 2)
+        self.recreate_elsewhere(casts=3)
+        self.assertEqual(len(self.client.get('/api/ctd/casts/get/AR001').json()), 3)
+        # And the fresh result is what was cached
+        self.assertEqual(len(self.client.get('/api/ctd/casts/get/AR001').json()), 3)
+
+    def test_recreated_cruise_without_casts(self):
+        self.client.get('/api/ctd/casts/get/AR001')
+        self.recreate_elsewhere(casts=0)
+        self.assertEqual(self.client.get('/api/ctd/casts/get/AR001').json(), [])
+
+    def test_deleted_cruise_is_404(self):
+        self.client.get('/api/ctd/casts/get/AR001')
+        self.recreate_elsewhere(casts=None)
+        self.assertEqual(self.client.get('/api/ctd/casts/get/AR001').status_code, 404)
+
+    def test_recreated_cast_lists_new_niskins(self):
+        niskins = self.client.get('/api/ctd/niskins/get/all/AR001/2').json()
+        self.assertEqual([niskin['depth'] for niskin in niskins], [20])
+        self.recreate_elsewhere(casts=3)
+        niskins = self.client.get('/api/ctd/niskins/get/all/AR001/2').json()
+        self.assertEqual([niskin['depth'] for niskin in niskins], [20])
+
+    def test_deleted_cast_is_404(self):
+        self.client.get('/api/ctd/niskins/get/all/AR001/2')
+        self.recreate_elsewhere(casts=1)
+        self.assertEqual(self.client.get('/api/ctd/niskins/get/all/AR001/2').status_code, 404)
+
+
+class ConditionalGetTests(TestCase):
+    LIST_URLS = [
+        '/api/ctd/vessels/get/all',
+        '/api/ctd/cruises/get/all',
+        '/api/ctd/casts/get/AR001',
+        '/api/ctd/niskins/get/all/AR001/1',
+    ]
+    DETAIL_URLS = [
+        '/api/ctd/vessels/get/armstrong',
+        '/api/ctd/cruises/get/AR001',
+        '/api/ctd/cast/get/AR001/1',
+        '/api/ctd/niskins/get/AR001/1/1',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        vessel = Vessel.objects.create(designation='R/V', name='Armstrong', short_name='Armstrong', code='AR')
+        cruise = Cruise.objects.create(name='AR001', vessel=vessel, start_time=START, end_time=START)
+        cast = Cast.objects.create(
+            cruise=cruise, number='1', depth=100, geolocation=Point(-70.5, 41.0, srid=4326), start_time=START)
+        Niskin.objects.create(cast=cast, number=1, depth=10, geolocation=Point(-70.5, 41.0, srid=4326))
+
+    def setUp(self):
+        for alias in ('default', 'ctd'):
+            caches[alias].clear()
+        resolver._cruises.clear()
+        resolver._casts.clear()
+
+    def test_validators_and_not_modified(self):
+        for url in self.LIST_URLS + self.DETAIL_URLS:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag, last_modified = response['ETag'], response['Last-Modified']
+                # Answered from the version markers alone
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_after_write(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.LIST_URLS + self.DETAIL_URLS}
+        response = self.client.post('/api/ctd/casts/update/AR001/1', {
+            'latitude': 41.1, 'longitude': -70.6, 'depth': 120, 'start_time': '2020-01-01T00:00:00Z',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # Casts and, through the cascade, niskins changed; vessels and cruises did not
+        for url, etag in etags.items():
+            changed = '/cast' in url or '/niskins' in url
+            with self.subTest(url=url):
+                response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200 if changed else 304)
+                self.assertEqual(response['ETag'] != etag, changed)
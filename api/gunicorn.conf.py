@@ -0,0 +1,46 @@
+# Gunicorn settings for the production profile (DJANGO_ENV=production)
+import multiprocessing
+import os
+import shutil
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8000'))
+
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# Async read views run natively under uvicorn workers; set
+# GUNICORN_WORKER_CLASS=sync (with config.wsgi:application) for plain WSGI
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+
+# Import Django and the app once in the master so workers fork with it
+# already loaded. No database connections are opened at import time.
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Per-worker Prometheus metric files, aggregated by /metrics. The directory
+# is set and emptied here because the preloaded app (and prometheus_client)
+# is imported before any server hook runs.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+os.makedirs(PROMETHEUS_MULTIPROC_DIR)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_starting(server):
+    # The app is preloaded by now. Version markers and cached responses in a
+    # process-local cache are not seen by the other workers, so a write made
+    # through one worker would go unnoticed by the rest.
+    from django.conf import settings
+
+    local = sorted(
+        alias for alias, cache in settings.CACHES.items()
+        if cache['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache'
+    )
+    if server.cfg.workers > 1 and local:
+        raise RuntimeError(
+            'Caches {} are process-local but {} workers are configured; use a shared '
+            'cache backend (DJANGO_REDIS_URL) or GUNICORN_WORKERS=1'.format(', '.join(local), server.cfg.workers))
@@ -1,27 +1,54 @@
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from ninja import Router
 
-from .services import StationService, StationInput, StationLocationInput, StationQueryOutput, \
-    NearestStationQueryInput, NearestStationQueryOutput, AddNearestStationInput, AddNearestStationOutput
+from core.conditional import conditional_response
+from core.renderers import render_rows
+
+from . import columnar, streaming
+from .services import StationService, StationInput, StationLocationInput, StationLocationsInput, StationQueryOutput, \
+    NearestStationQueryInput, NearestStationQueryOutput, AddNearestStationInput, AddNearestStationOutput, \
+    StationsWithinInput, StationWithinOutput, StationPassesInput, StationPassOutput
 
 
 router = Router()
 
 @router.get("/now", response=List[StationQueryOutput])
-def get_stations_now(request):
-    return StationService.get_stations()
+async def get_stations_now(request, response: HttpResponse):
+    now = timezone.now()
+    validators = await StationService.aget_validators(now, live=True)
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    return render_rows(router, request, response, await StationService.aget_stations(now))
 
 
 @router.get("/at/{timestamp}", response=List[StationQueryOutput])
-def get_stations(request, timestamp: datetime):
-    return StationService.get_stations(timestamp)
+async def get_stations(request, response: HttpResponse, timestamp: datetime):
+    validators = await StationService.aget_validators(timestamp)
+    not_modified = conditional_response(request, response, validators)
+    if not_modified is not None:
+        return not_modified
+    return render_rows(router, request, response, await StationService.aget_stations(timestamp))
+
+
+@router.get("/cache/stats")
+def get_cache_stats(request):
+    return StationService.get_cache_stats()
 
 
 @router.post('/nearest', response=NearestStationQueryOutput)
-def get_nearest_station(request, query: NearestStationQueryInput):
-    return StationService.get_nearest_station(query)
+async def get_nearest_station(request, query: NearestStationQueryInput):
+    return await StationService.aget_nearest_station(query)
+
+
+@router.post('/within', response=List[StationWithinOutput])
+async def get_stations_within(request, query: StationsWithinInput):
+    return await StationService.aget_stations_within(query)
 
 
 @router.post('/create')
@@ -36,10 +63,46 @@ def set_location(request, input: StationLocationInput):
     return 204
 
 
+@router.post('/set_locations')
+def set_locations(request, input: StationLocationsInput):
+    StationService.set_locations(input)
+    return 204
+
+
 @router.post('/add_nearest', response=AddNearestStationOutput)
-def add_nearest_station(request, input: AddNearestStationInput):
+def add_nearest_station(request, input: AddNearestStationInput, format: Optional[str] = None):
+    # Stream annotated rows as NDJSON or CSV when asked for via ?format= or Accept
+    media_type = streaming.negotiate(request, format)
+    if media_type is not None:
+        rows = StationService.iter_nearest_station(
+            latitude=input.latitude,
+            longitude=input.longitude,
+            timestamp=input.timestamp
+        )
+        lines = streaming.ENCODERS[media_type](rows)
+        if isinstance(request, ASGIRequest):
+            lines = streaming.aiter_lines(lines)
+        return StreamingHttpResponse(lines, content_type=media_type)
     return StationService.add_nearest_station(
         latitude=input.latitude,
         longitude=input.longitude,
         timestamp=input.timestamp
-    )
\ No newline at end of file
+    )
+
+
+@router.post('/passes', response=List[StationPassOutput])
+def get_station_passes(request, input: StationPassesInput):
+    return StationService.get_station_passes(input)
+
+
+@router.post('/add_nearest/npz', openapi_extra={
+    'requestBody': {
+        'content': {columnar.MEDIA_TYPE: {'schema': {'type': 'string', 'format': 'binary'}}},
+        'required': True,
+    },
+})
+def add_nearest_station_npz(request):
+    # Columnar (.npz) equivalent of /add_nearest, see stations/columnar.py
+    latitude, longitude, timestamp_us = columnar.read_npz(request.body)
+    station, distance_km = StationService.add_nearest_station_columns(latitude, longitude, timestamp_us)
+    return HttpResponse(columnar.write_npz(station, distance_km), content_type=columnar.MEDIA_TYPE)
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class StationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stations'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+
+        from core.models import Station, StationLocation
+        from core.signals import station_locations_changed
+        from . import cache, index
+
+        for name, invalidate in (('station_index', index.invalidate), ('station_cache', cache.invalidate)):
+            station_locations_changed.connect(invalidate, dispatch_uid=name)
+            for model in (Station, StationLocation):
+                post_save.connect(invalidate, sender=model, dispatch_uid=name)
+                post_delete.connect(invalidate, sender=model, dispatch_uid=name)
@@ -0,0 +1,111 @@
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from core.caching import CacheStats, aget_version, bump_version, get_version
+from core.conditional import validators
+from core.models import StationLocation
+
+
+# Snapshot cache for the station positions served by /stations/now and
+# /stations/at/{timestamp}.
+#
+# Station.get_locations returns the same answer for every timestamp between
+# two consecutive start/end boundaries of the location timeline, so entries
+# are keyed on that epoch rather than on the raw timestamp. Keys also carry
+# the "stations" version, which every location write bumps.
+
+FAMILY = 'stations'
+
+stats = CacheStats()
+
+
+def _cache():
+    return caches[getattr(settings, 'STATION_SNAPSHOT_CACHE', 'default')]
+
+
+def get_boundaries(version):
+    key = 'stations:{}:boundaries'.format(version)
+    boundaries = _cache().get(key)
+    if boundaries is None:
+        times = StationLocation.objects.values_list('start_time', 'end_time')
+        boundaries = sorted({t for row in times for t in row if t is not None})
+        _cache().set(key, boundaries)
+    return boundaries
+
+
+async def aget_boundaries(version):
+    key = 'stations:{}:boundaries'.format(version)
+    boundaries = await _cache().aget(key)
+    if boundaries is None:
+        times = StationLocation.objects.values_list('start_time', 'end_time')
+        boundaries = sorted({t async for row in times for t in row if t is not None})
+        await _cache().aset(key, boundaries)
+    return boundaries
+
+
+def epoch_of(boundaries, timestamp):
+    # Even epochs are the open intervals between boundaries, odd epochs the
+    # boundary instants themselves (where end_time is inclusive)
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    i = bisect_left(boundaries, timestamp)
+    exact = i < len(boundaries) and boundaries[i] == timestamp
+    return 2 * i + int(exact)
+
+
+def get_snapshot(timestamp, compute):
+    version = get_version(FAMILY)
+    epoch = epoch_of(get_boundaries(version), timestamp)
+    key = 'stations:{}:snapshot:{}'.format(version, epoch)
+
+    snapshot = _cache().get(key)
+    if snapshot is None:
+        stats.miss()
+        snapshot = compute(timestamp)
+        _cache().set(key, snapshot)
+    else:
+        stats.hit()
+    return snapshot
+
+
+async def aget_snapshot(timestamp, acompute):
+    version = await aget_version(FAMILY)
+    epoch = epoch_of(await aget_boundaries(version), timestamp)
+    key = 'stations:{}:snapshot:{}'.format(version, epoch)
+
+    snapshot = await _cache().aget(key)
+    if snapshot is None:
+        stats.miss()
+        snapshot = await acompute(timestamp)
+        await _cache().aset(key, snapshot)
+    else:
+        stats.hit()
+    return snapshot
+
+
+def _validators(version, boundaries, timestamp, live):
+    # The snapshot for an epoch only changes on a write. For /stations/now it
+    # also changes when the current time enters a new epoch, so that epoch's
+    # start is a later modification time than the last write.
+    epoch = epoch_of(boundaries, timestamp)
+    last_modified = version // 1_000_000_000
+    if live and epoch > 0:
+        last_modified = max(last_modified, boundaries[(epoch - 1) // 2].timestamp())
+    return validators(FAMILY, version, epoch, last_modified=last_modified)
+
+
+def get_validators(timestamp, live=False):
+    version = get_version(FAMILY)
+    return _validators(version, get_boundaries(version), timestamp, live)
+
+
+async def aget_validators(timestamp, live=False):
+    version = await aget_version(FAMILY)
+    return _validators(version, await aget_boundaries(version), timestamp, live)
+
+
+def invalidate(**kwargs):
+    bump_version(FAMILY)
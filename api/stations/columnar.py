@@ -0,0 +1,56 @@
+import io
+import zipfile
+
+import numpy as np
+from ninja.errors import HttpError
+
+
+# Columnar wire format for /stations/add_nearest/npz: a NumPy .npz archive.
+#
+# Request arrays: latitude and longitude (float), timestamp as seconds since
+# the epoch (int or float) or datetime64. Response arrays: station (unicode,
+# '' where no station is active) and distance_km (float64, NaN where no
+# station is active).
+
+MEDIA_TYPE = 'application/x-npz'
+
+INPUT_COLUMNS = ('latitude', 'longitude', 'timestamp')
+
+
+def _timestamp_us(timestamp):
+    if np.issubdtype(timestamp.dtype, np.datetime64):
+        return timestamp.astype('datetime64[us]').astype(np.int64)
+    if np.issubdtype(timestamp.dtype, np.integer):
+        return timestamp.astype(np.int64) * 1000000
+    if np.issubdtype(timestamp.dtype, np.floating):
+        return np.round(timestamp * 1e6).astype(np.int64)
+    raise HttpError(400, 'timestamp must be epoch seconds or datetime64')
+
+
+def read_npz(body):
+    # Returns latitude, longitude (float64) and timestamp (epoch microseconds)
+    try:
+        archive = np.load(io.BytesIO(body), allow_pickle=False)
+        columns = {name: archive[name] for name in INPUT_COLUMNS}
+    except KeyError as e:
+        raise HttpError(400, 'Missing array {}'.format(e))
+    except (ValueError, IndexError, OSError, zipfile.BadZipFile):
+        raise HttpError(400, 'Request body is not a valid .npz archive')
+
+    if any(column.ndim != 1 for column in columns.values()):
+        raise HttpError(400, 'Arrays must be one-dimensional')
+    if len({len(column) for column in columns.values()}) != 1:
+        raise HttpError(400, 'Arrays must have the same length')
+
+    try:
+        latitude = columns['latitude'].astype(np.float64)
+        longitude = columns['longitude'].astype(np.float64)
+    except (TypeError, ValueError):
+        raise HttpError(400, 'latitude and longitude must be numeric')
+    return latitude, longitude, _timestamp_us(columns['timestamp'])
+
+
+def write_npz(station, distance_km):
+    buffer = io.BytesIO()
+    np.savez(buffer, station=station, distance_km=distance_km)
+    return buffer.getvalue()
@@ -0,0 +1,170 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from core.models import StationLocation
+
+from . import parallel
+from .kernel import nearest_kernel
+
+
+# In-process spatio-temporal index over StationLocation.
+#
+# The timeline is cut at every distinct start_time/end_time into segments:
+# even segment 2*i is the open interval (B[i-1], B[i]) and odd segment
+# 2*i+1 is the instant B[i], where B are the sorted boundaries. The set of
+# active locations is constant within a segment, so a lookup is a binary
+# search for the segment followed by a vectorized distance kernel over that
+# segment's members (see stations/kernel.py).
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_microseconds(timestamp):
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return (timestamp - EPOCH) // ONE_MICROSECOND
+
+
+class StationIndex:
+    def __init__(self, arrays, names):
+        self.arrays = arrays
+        self.names = names
+        # Fixed-width copy of the names for columnar output
+        self.names_unicode = names.astype(str) if len(names) else np.array([], dtype=str)
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        rows = list(
+            StationLocation.objects
+            .filter(start_time__isnull=False)
+            .values_list('station__name', 'start_time', 'end_time', 'geolocation')
+        )
+
+        names = np.array([row[0] for row in rows], dtype=object)
+        latitude = np.array([row[3].y for row in rows], dtype=np.float64)
+        longitude = np.array([row[3].x for row in rows], dtype=np.float64)
+        start = np.array([to_microseconds(row[1]) for row in rows], dtype=np.int64)
+        # An open-ended location is active until the end of time
+        end = np.array(
+            [to_microseconds(row[2]) if row[2] is not None else np.iinfo(np.int64).max for row in rows],
+            dtype=np.int64,
+        )
+
+        boundaries = np.unique(np.concatenate([start, end[end != np.iinfo(np.int64).max]]))
+
+        # Active at an instant: start <= t <= end (end inclusive, as in the ORM queries).
+        # Active over an open interval (a, b): start <= a and end >= b.
+        lower = np.concatenate([[np.iinfo(np.int64).min], boundaries])
+        upper = np.concatenate([boundaries, [np.iinfo(np.int64).max]])
+        open_active = (start[None, :] <= lower[:, None]) & (end[None, :] >= upper[:, None])
+        instant_active = (start[None, :] <= boundaries[:, None]) & (end[None, :] >= boundaries[:, None])
+
+        active = np.empty((len(lower) + len(boundaries), len(rows)), dtype=bool)
+        active[0::2] = open_active
+        active[1::2] = instant_active
+
+        segment_ptr = np.zeros(len(active) + 1, dtype=np.int64)
+        np.cumsum(active.sum(axis=1), out=segment_ptr[1:])
+        segment_members = np.nonzero(active)[1].astype(np.int64)
+
+        arrays = {
+            'boundaries': boundaries,
+            'segment_ptr': segment_ptr,
+            'segment_members': segment_members,
+            'latitude': latitude,
+            'longitude': longitude,
+            'latitude_rad': np.radians(latitude),
+            'longitude_rad': np.radians(longitude),
+        }
+        return cls(arrays, names)
+
+    def is_stale(self):
+        ttl = getattr(settings, 'STATION_INDEX_TTL', None)
+        return ttl is not None and time.monotonic() - self.built_at > ttl
+
+    def nearest(self, latitude, longitude, timestamp=None, max_distance_km=None):
+        if timestamp is None:
+            timestamp = timezone.now()
+        location, distance = nearest_kernel(
+            self.arrays, [latitude], [longitude], [to_microseconds(timestamp)])
+        if location[0] < 0:
+            return None
+        if max_distance_km is not None and distance[0] > max_distance_km * 1000:
+            return None
+        i = location[0]
+        return NearestStation(
+            station_name=self.names[i],
+            latitude=float(self.arrays['latitude'][i]),
+            longitude=float(self.arrays['longitude'][i]),
+            distance_km=float(distance[0]) / 1000,
+        )
+
+    def nearest_batch(self, latitude, longitude, timestamp_us):
+        # Batches larger than one parallel chunk are split across the worker
+        # pool when ADD_NEAREST_WORKERS is set
+        workers = getattr(settings, 'ADD_NEAREST_WORKERS', 0)
+        chunk_size = getattr(settings, 'ADD_NEAREST_PARALLEL_CHUNK_SIZE', 250000)
+        if workers > 1 and len(timestamp_us) > chunk_size:
+            return parallel.get_pool(self, workers).nearest(latitude, longitude, timestamp_us, chunk_size)
+        return nearest_kernel(self.arrays, latitude, longitude, timestamp_us)
+
+    def add_nearest_station(self, latitude, longitude, timestamp):
+        # Same output shape as Station.add_nearest_station
+        timestamp = np.fromiter(
+            (to_microseconds(t) for t in timestamp), dtype=np.int64, count=len(timestamp))
+        location, distance = self.nearest_batch(latitude, longitude, timestamp)
+        found = location >= 0
+        names = np.full(len(location), None, dtype=object)
+        names[found] = self.names[location[found]]
+        distance_km = np.full(len(location), None, dtype=object)
+        distance_km[found] = distance[found] / 1000
+        return names.tolist(), distance_km.tolist()
+
+    def add_nearest_station_columns(self, latitude, longitude, timestamp_us):
+        # Columnar variant: NumPy arrays in (timestamps as epoch microseconds),
+        # a fixed-width station name array ('' for no match) and distances in
+        # km (NaN for no match) out, with no per-point Python objects
+        location, distance = self.nearest_batch(latitude, longitude, timestamp_us)
+        found = location >= 0
+        station = np.full(len(location), '', dtype=self.names_unicode.dtype)
+        station[found] = self.names_unicode[location[found]]
+        return station, distance / 1000
+
+
+class NearestStation(NamedTuple):
+    station_name: str
+    latitude: float
+    longitude: float
+    distance_km: float
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'STATION_INDEX_ENABLED', False)
+
+
+def get_index():
+    global _index
+    index = _index
+    if index is None or index.is_stale():
+        with _lock:
+            if _index is None or _index.is_stale():
+                _index = StationIndex.build()
+            index = _index
+    return index
+
+
+def invalidate(**kwargs):
+    global _index
+    _index = None
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+# Nearest-station kernel over the arrays built by stations.index.StationIndex.
+# Kept free of Django imports so that worker processes (stations.parallel)
+# can import it without configuring Django.
+#
+# Distances use the same great-circle formula and earth radius as PostGIS
+# ST_DistanceSphere (what the Distance annotation compiles to): the WGS84
+# mean radius (2a + b) / 3, also used for geography on a sphere. Agreement
+# with the database is checked in stations/tests.py.
+
+EARTH_RADIUS_M = 6371008.7714150598
+
+# Upper bound on the size of one distance matrix in the batch kernel
+KERNEL_BLOCK_SIZE = 1 << 18
+
+
+def sphere_distance(lat1, lon1, lat2, lon2):
+    # Inputs in radians, output in meters; same formulation as PostGIS
+    # sphere_distance() for numerical agreement with ST_DistanceSphere
+    d_lon = lon2 - lon1
+    cos_lat1, sin_lat1 = np.cos(lat1), np.sin(lat1)
+    cos_lat2, sin_lat2 = np.cos(lat2), np.sin(lat2)
+    cos_d_lon = np.cos(d_lon)
+    a1 = (cos_lat2 * np.sin(d_lon)) ** 2
+    a2 = (cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_d_lon) ** 2
+    b = sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_d_lon
+    return np.arctan2(np.sqrt(a1 + a2), b) * EARTH_RADIUS_M
+
+
+def segment_of(boundaries, timestamp):
+    position = np.searchsorted(boundaries, timestamp, side='left')
+    if len(boundaries) == 0:
+        return position * 2
+    exact = boundaries[np.minimum(position, len(boundaries) - 1)] == timestamp
+    return position * 2 + exact
+
+
+def nearest_kernel(arrays, latitude, longitude, timestamp):
+    # Returns the index of the nearest active location for every point
+    # (-1 where none is active) and the distance to it in meters
+    latitude = np.radians(np.asarray(latitude, dtype=np.float64))
+    longitude = np.radians(np.asarray(longitude, dtype=np.float64))
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+
+    location = np.full(len(timestamp), -1, dtype=np.int64)
+    distance = np.full(len(timestamp), np.nan, dtype=np.float64)
+
+    segment = segment_of(arrays['boundaries'], timestamp)
+    order = np.argsort(segment, kind='stable')
+    segments, starts = np.unique(segment[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    segment_ptr = arrays['segment_ptr']
+    segment_members = arrays['segment_members']
+    location_latitude = arrays['latitude_rad']
+    location_longitude = arrays['longitude_rad']
+
+    for seg, start, end in zip(segments, starts, ends):
+        members = segment_members[segment_ptr[seg]:segment_ptr[seg + 1]]
+        if len(members) == 0:
+            continue
+        block = max(1, KERNEL_BLOCK_SIZE // len(members))
+        for block_start in range(start, end, block):
+            points = order[block_start:min(block_start + block, end)]
+            d = sphere_distance(
+                latitude[points, None],
+                longitude[points, None],
+                location_latitude[None, members],
+                location_longitude[None, members],
+            )
+            nearest = np.argmin(d, axis=1)
+            location[points] = members[nearest]
+            distance[points] = d[np.arange(len(points)), nearest]
+
+    return location, distance
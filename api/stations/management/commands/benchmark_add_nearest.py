@@ -0,0 +1,115 @@
+import os
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from core.models import Station, StationLocation
+from stations.index import StationIndex, to_microseconds
+from stations.parallel import NearestPool
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-point, batch and in-memory index add_nearest_station paths at several batch sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scaling-size', type=int, default=0,
+                            help='Also measure index throughput on this many points with 1..N worker processes')
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+        parser.add_argument('--chunk-size', type=int, default=250000)
+
+    def handle(self, *args, **options):
+        extent = StationLocation.objects.aggregate(
+            start=Min('start_time'),
+            end=Max('end_time'),
+        )
+        if extent['start'] is None:
+            raise CommandError('No station locations found; create some stations first')
+        start = extent['start']
+        end = extent['end'] or timezone.now()
+
+        rng = random.Random(options['seed'])
+        station_index = StationIndex.build()
+        self.stdout.write('{:>8} {:>14} {:>12} {:>10} {:>12} {:>10} {:>9}'.format(
+            'size', 'per-point (s)', 'batch (s)', 'speedup', 'index (s)', 'speedup', 'match'))
+
+        for size in options['sizes']:
+            latitude = [rng.uniform(39.5, 41.5) for _ in range(size)]
+            longitude = [rng.uniform(-71.5, -70.0) for _ in range(size)]
+            span = (end - start).total_seconds()
+            timestamp = [start + timedelta(seconds=rng.uniform(0, span)) for _ in range(size)]
+
+            iterative_time, iterative_result = self._best_of(
+                options['repeat'], self._per_point, latitude, longitude, timestamp)
+            batch_time, batch_result = self._best_of(
+                options['repeat'], Station.add_nearest_station, latitude, longitude, timestamp)
+            index_time, index_result = self._best_of(
+                options['repeat'], station_index.add_nearest_station, latitude, longitude, timestamp)
+
+            self.stdout.write('{:>8} {:>14.4f} {:>12.4f} {:>9.1f}x {:>12.4f} {:>9.1f}x {:>9}'.format(
+                size,
+                iterative_time,
+                batch_time,
+                iterative_time / batch_time,
+                index_time,
+                iterative_time / index_time,
+                str(iterative_result[0] == batch_result[0] == index_result[0]),
+            ))
+
+        if options['scaling_size']:
+            self._scaling(station_index, rng, start, end, options)
+
+    def _scaling(self, station_index, rng, start, end, options):
+        size = options['scaling_size']
+        span = (end - start).total_seconds()
+        latitude = [rng.uniform(39.5, 41.5) for _ in range(size)]
+        longitude = [rng.uniform(-71.5, -70.0) for _ in range(size)]
+        timestamp_us = [to_microseconds(start + timedelta(seconds=rng.uniform(0, span))) for _ in range(size)]
+
+        self.stdout.write('')
+        self.stdout.write('{:>8} {:>12} {:>16} {:>10}'.format('workers', 'time (s)', 'points/s', 'scaling'))
+        baseline = None
+        for workers in range(1, options['max_workers'] + 1):
+            pool = NearestPool(workers)
+            pool.publish(station_index.arrays)
+            try:
+                # Warm up so worker start-up is not counted
+                pool.nearest(latitude[:workers], longitude[:workers], timestamp_us[:workers], 1)
+                elapsed, _ = self._best_of(
+                    options['repeat'], pool.nearest, latitude, longitude, timestamp_us, options['chunk_size'])
+            finally:
+                pool.close()
+            baseline = baseline or elapsed
+            self.stdout.write('{:>8} {:>12.4f} {:>16,.0f} {:>9.2f}x'.format(
+                workers, elapsed, size / elapsed, baseline / elapsed))
+
+    @staticmethod
+    def _per_point(latitude, longitude, timestamp):
+        # The original implementation: one nearest_location() lookup per point
+        names, distances = [], []
+        for lat, lon, ts in zip(latitude, longitude, timestamp):
+            location = Station.nearest_location(lat, lon, ts)
+            if location is not None:
+                names.append(location.station_name)
+                distances.append(location.distance.km)
+            else:
+                names.append(None)
+                distances.append(None)
+        return names, distances
+
+    @staticmethod
+    def _best_of(repeat, func, *args):
+        best, result = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - started
+            if best is None or elapsed < best:
+                best = elapsed
+        return best, result
@@ -0,0 +1,153 @@
+import atexit
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import get_context, resource_tracker, shared_memory
+
+import numpy as np
+
+from .kernel import nearest_kernel
+
+
+# Parallel execution of the nearest-station kernel for large batches.
+#
+# The station index arrays are copied into shared memory blocks, so only the
+# point chunks and the (small) block spec are pickled per task. Workers are
+# spawned rather than forked and only import this module and
+# stations.kernel, so they never touch Django or the database connections
+# of the parent process.
+#
+# One pool lives for the whole process. When the index is rebuilt only a
+# new generation of blocks is published: each task names the generation it
+# was submitted with and a worker re-attaches when that changes. The parent
+# unlinks a superseded generation as soon as no batch is using it any more.
+
+class SharedArrays:
+    def __init__(self, arrays):
+        self.blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+        self.users = 0
+        self.retired = False
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# Per-worker state, set by _attach()
+_blocks = []
+_arrays = None
+_attached = None
+
+
+def _attach(spec):
+    global _arrays, _attached
+    if _attached == spec:
+        return
+    # Drop the views before closing the blocks they point into
+    _arrays = None
+    for block in _blocks:
+        block.close()
+    _blocks.clear()
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+        else:
+            block = shared_memory.SharedMemory(name=block_name)
+            # The parent owns and unlinks the block; stop this worker's
+            # resource tracker from unlinking it again when the worker exits
+            resource_tracker.unregister(block._name, 'shared_memory')
+        _blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _arrays = arrays
+    _attached = spec
+
+
+def _run_chunk(spec, latitude, longitude, timestamp):
+    _attach(spec)
+    return nearest_kernel(_arrays, latitude, longitude, timestamp)
+
+
+class NearestPool:
+    def __init__(self, workers):
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+        self.shared = None
+        self._lock = threading.Lock()
+
+    def publish(self, arrays):
+        # Make arrays the ones used by batches started from now on
+        shared = SharedArrays(arrays)
+        with self._lock:
+            previous, self.shared = self.shared, shared
+            if previous is not None:
+                self._retire(previous)
+
+    def _retire(self, shared):
+        # Called with the lock held
+        shared.retired = True
+        if shared.users == 0:
+            shared.close()
+
+    def nearest(self, latitude, longitude, timestamp, chunk_size):
+        # Same result as nearest_kernel(arrays, ...) on the published arrays,
+        # computed chunk by chunk on the pool and reassembled in input order
+        with self._lock:
+            shared = self.shared
+            shared.users += 1
+        try:
+            latitude = np.asarray(latitude, dtype=np.float64)
+            longitude = np.asarray(longitude, dtype=np.float64)
+            timestamp = np.asarray(timestamp, dtype=np.int64)
+            starts = range(0, len(timestamp), chunk_size)
+            results = list(self.executor.map(
+                _run_chunk,
+                repeat(shared.spec),
+                [latitude[start:start + chunk_size] for start in starts],
+                [longitude[start:start + chunk_size] for start in starts],
+                [timestamp[start:start + chunk_size] for start in starts],
+            ))
+        finally:
+            with self._lock:
+                shared.users -= 1
+                if shared.retired and shared.users == 0:
+                    shared.close()
+        if not results:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        location = np.concatenate([location for location, _ in results])
+        distance = np.concatenate([distance for _, distance in results])
+        return location, distance
+
+    def close(self):
+        # Let in-flight batches finish before the shared memory goes away
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            if self.shared is not None:
+                self._retire(self.shared)
+                self.shared = None
+
+
+# One pool per process, fed the arrays of the current index
+_pool = None
+_pool_owner = None
+_lock = threading.Lock()
+
+
+def get_pool(index, workers):
+    global _pool, _pool_owner
+    with _lock:
+        if _pool is None:
+            _pool = NearestPool(workers)
+            atexit.register(_pool.close)
+        if _pool_owner is not index:
+            _pool.publish(index.arrays)
+            _pool_owner = index
+        return _pool
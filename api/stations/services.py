@@ -1,10 +1,19 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from datetime import datetime
 
+from django.conf import settings
+from django.utils import timezone
+import numpy as np
+from asgiref.sync import sync_to_async
+from ninja.errors import HttpError
 from pydantic import BaseModel
 
+from core.conditional import Validators
 from core.models import Station, StationLocation
 
+from . import cache as station_cache
+from . import index as station_index
+
 
 class StationInput(BaseModel):
     name: str
@@ -21,6 +30,10 @@ class StationLocationInput(BaseModel):
     comment: Optional[str] = ''
 
 
+class StationLocationsInput(BaseModel):
+    locations: List[StationLocationInput]
+
+
 class StationQueryInput(BaseModel):
     station_name: str
     timestamp: datetime
@@ -44,6 +57,7 @@ class NearestStationQueryInput(BaseModel):
     latitude: float
     longitude: float
     timestamp: Optional[datetime] = None
+    max_distance_km: Optional[float] = None
 
 
 class NearestStationQueryOutput(BaseModel):
@@ -53,6 +67,27 @@ class NearestStationQueryOutput(BaseModel):
     distance: float
 
 
+class StationsWithinInput(BaseModel):
+    # Either a circle (latitude, longitude and radius_km) or a bbox given as
+    # (west, south, east, north) in degrees
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    radius_km: Optional[float] = None
+    bbox: Optional[Tuple[float, float, float, float]] = None
+    timestamp: Optional[datetime] = None
+
+
+class StationWithinOutput(BaseModel):
+    station_name: str
+    latitude: float
+    longitude: float
+    distance: float  # km from the circle's or the bbox's center
+    start_time: datetime
+    end_time: Optional[datetime] = None
+    depth: Optional[float] = None
+    comment: Optional[str] = None
+
+
 class AddNearestStationInput(BaseModel):
     latitude: List[float]
     longitude: List[float]
@@ -60,15 +95,32 @@ class AddNearestStationInput(BaseModel):
 
 
 class AddNearestStationOutput(BaseModel):
-    station: List[str]
-    distance_km: List[float]
+    station: List[Optional[str]]
+    distance_km: List[Optional[float]]
+
+
+class StationPassesInput(BaseModel):
+    latitude: List[float]
+    longitude: List[float]
+    timestamp: List[datetime]
+    radius_km: float
+
+
+class StationPassOutput(BaseModel):
+    station_name: str
+    start_time: datetime
+    end_time: datetime
+    closest_time: datetime
+    min_distance_km: float
+    fixes: int
 
 
 class StationService:
     @staticmethod
     def serialize_station_location(location: StationLocation) -> StationQueryOutput:
+        # Expects the station_name annotation added by Station.active_locations
         return StationQueryOutput(
-            station_name=location.content_object.name,
+            station_name=location.station_name,
             latitude=location.geolocation.y,
             longitude=location.geolocation.x,
             start_time=location.start_time,
@@ -83,6 +135,7 @@ class StationService:
             name=station_input.name,
             full_name=station_input.full_name
         )
+        station_cache.invalidate()
 
     @staticmethod
     def set_location(location: StationLocationInput):
@@ -97,28 +150,160 @@ class StationService:
         )
 
     @staticmethod
-    def get_nearest_station(query: NearestStationQueryInput) -> NearestStationQueryOutput:
-        station_location = Station.nearest_location(
-            latitude=query.latitude,
-            longitude=query.longitude,
-            timestamp=query.timestamp
-        )
+    def set_locations(locations_input: StationLocationsInput):
+        names = {location.station_name for location in locations_input.locations}
+        stations = {station.name: station for station in Station.objects.filter(name__in=names)}
+        missing = names - stations.keys()
+        if missing:
+            raise HttpError(404, f"Stations not found: {', '.join(sorted(missing))}")
+        try:
+            Station.set_locations(
+                (stations[location.station_name], location.model_dump(exclude={'station_name'}))
+                for location in locations_input.locations
+            )
+        except ValueError as e:
+            raise HttpError(400, str(e))
+
+    @staticmethod
+    def serialize_nearest_station(nearest) -> NearestStationQueryOutput:
+        # Accepts either a StationLocation from Station.distances or an
+        # index.NearestStation
+        if nearest is None:
+            raise HttpError(404, "No active station found.")
+        if isinstance(nearest, StationLocation):
+            return NearestStationQueryOutput(
+                station_name=nearest.station_name,
+                latitude=nearest.geolocation.y,
+                longitude=nearest.geolocation.x,
+                distance=nearest.distance.km
+            )
         return NearestStationQueryOutput(
-            station_name=station_location.content_object.name,
-            latitude=station_location.geolocation.y,
-            longitude=station_location.geolocation.x,
-            distance=station_location.distance.km
+            station_name=nearest.station_name,
+            latitude=nearest.latitude,
+            longitude=nearest.longitude,
+            distance=nearest.distance_km
         )
+
+    @classmethod
+    def get_nearest_station(cls, query: NearestStationQueryInput) -> NearestStationQueryOutput:
+        if station_index.is_enabled():
+            nearest = station_index.get_index().nearest(
+                latitude=query.latitude,
+                longitude=query.longitude,
+                timestamp=query.timestamp,
+                max_distance_km=query.max_distance_km
+            )
+        else:
+            nearest = Station.nearest_location(
+                latitude=query.latitude,
+                longitude=query.longitude,
+                timestamp=query.timestamp,
+                max_distance_km=query.max_distance_km
+            )
+        return cls.serialize_nearest_station(nearest)
+
+    @classmethod
+    async def aget_nearest_station(cls, query: NearestStationQueryInput) -> NearestStationQueryOutput:
+        if station_index.is_enabled():
+            # Building the index queries the database, so it runs off the event loop
+            index = await sync_to_async(station_index.get_index)()
+            nearest = index.nearest(
+                latitude=query.latitude,
+                longitude=query.longitude,
+                timestamp=query.timestamp,
+                max_distance_km=query.max_distance_km
+            )
+        else:
+            nearest = await Station.anearest_location(
+                latitude=query.latitude,
+                longitude=query.longitude,
+                timestamp=query.timestamp,
+                max_distance_km=query.max_distance_km
+            )
+        return cls.serialize_nearest_station(nearest)
     
+    @staticmethod
+    def within_locations(query: StationsWithinInput):
+        circle = (query.latitude, query.longitude, query.radius_km)
+        if query.bbox is not None:
+            if any(value is not None for value in circle):
+                raise HttpError(400, "Give either latitude, longitude and radius_km or bbox, not both.")
+            west, south, east, north = query.bbox
+            if west > east or south > north:
+                raise HttpError(400, "bbox must be (west, south, east, north).")
+            return Station.within_bbox(west, south, east, north, query.timestamp)
+        if any(value is None for value in circle):
+            raise HttpError(400, "Give either latitude, longitude and radius_km or bbox.")
+        if query.radius_km < 0:
+            raise HttpError(400, "radius_km must not be negative.")
+        return Station.within_radius(query.latitude, query.longitude, query.radius_km, query.timestamp)
+
+    @staticmethod
+    def serialize_station_within(location: StationLocation) -> StationWithinOutput:
+        return StationWithinOutput(
+            station_name=location.station_name,
+            latitude=location.geolocation.y,
+            longitude=location.geolocation.x,
+            distance=location.distance.km,
+            start_time=location.start_time,
+            end_time=location.end_time,
+            depth=location.depth,
+            comment=location.comment
+        )
+
+    @classmethod
+    def get_stations_within(cls, query: StationsWithinInput) -> List[StationWithinOutput]:
+        return [cls.serialize_station_within(location) for location in cls.within_locations(query)]
+
+    @classmethod
+    async def aget_stations_within(cls, query: StationsWithinInput) -> List[StationWithinOutput]:
+        return [cls.serialize_station_within(location) async for location in cls.within_locations(query)]
+
     @classmethod
     def get_stations(cls, timestamp: datetime = None) -> list[StationQueryOutput]:
+        if timestamp is None:
+            timestamp = timezone.now()
+        return station_cache.get_snapshot(timestamp, cls.compute_stations)
+
+    @classmethod
+    def compute_stations(cls, timestamp: datetime) -> list[StationQueryOutput]:
         station_locations = Station.get_locations(timestamp)
         return [cls.serialize_station_location(location) for location in station_locations]
+
+    @classmethod
+    async def aget_stations(cls, timestamp: datetime = None) -> list[StationQueryOutput]:
+        if timestamp is None:
+            timestamp = timezone.now()
+        return await station_cache.aget_snapshot(timestamp, cls.acompute_stations)
+
+    @classmethod
+    async def acompute_stations(cls, timestamp: datetime) -> list[StationQueryOutput]:
+        station_locations = await Station.aget_locations(timestamp)
+        return [cls.serialize_station_location(location) for location in station_locations]
+
+    @staticmethod
+    def get_validators(timestamp: datetime, live: bool = False) -> Validators:
+        # live: timestamp is the current time, as for /stations/now
+        return station_cache.get_validators(timestamp, live)
+
+    @staticmethod
+    async def aget_validators(timestamp: datetime, live: bool = False) -> Validators:
+        return await station_cache.aget_validators(timestamp, live)
+
+    @staticmethod
+    def get_cache_stats() -> dict:
+        return station_cache.stats.as_dict()
     
 
     @staticmethod
-    def add_nearest_station(latitude: List[float], longitude: List[float], timestamp: List[datetime]) -> AddNearestStationOutput:
-        station_name, distance_km = Station.add_nearest_station(
+    def nearest_station_function():
+        if station_index.is_enabled():
+            return station_index.get_index().add_nearest_station
+        return Station.add_nearest_station
+
+    @classmethod
+    def add_nearest_station(cls, latitude: List[float], longitude: List[float], timestamp: List[datetime]) -> AddNearestStationOutput:
+        station_name, distance_km = cls.nearest_station_function()(
             latitude=latitude,
             longitude=longitude,
             timestamp=timestamp
@@ -127,3 +312,52 @@ class StationService:
             station=station_name,
             distance_km=distance_km
         )
+
+    @staticmethod
+    def get_station_passes(passes_input: StationPassesInput) -> List[StationPassOutput]:
+        timestamp = passes_input.timestamp
+        if not len(passes_input.latitude) == len(passes_input.longitude) == len(timestamp):
+            raise HttpError(400, "latitude, longitude and timestamp must have the same length.")
+        if passes_input.radius_km < 0:
+            raise HttpError(400, "radius_km must not be negative.")
+        if any(later < earlier for earlier, later in zip(timestamp, timestamp[1:])):
+            raise HttpError(400, "timestamp must be in time order.")
+        passes = Station.station_passes(
+            latitude=passes_input.latitude,
+            longitude=passes_input.longitude,
+            timestamp=timestamp,
+            radius_km=passes_input.radius_km
+        )
+        return [
+            StationPassOutput(
+                station_name=name,
+                start_time=start_time,
+                end_time=end_time,
+                closest_time=closest_time,
+                min_distance_km=min_distance_km,
+                fixes=fixes
+            )
+            for name, start_time, end_time, closest_time, min_distance_km, fixes in passes
+        ]
+
+    @classmethod
+    def iter_nearest_station(cls, latitude: List[float], longitude: List[float], timestamp: List[datetime], chunk_size: int = None):
+        # Yields (latitude, longitude, timestamp, station, distance_km) rows,
+        # resolving the input one fixed-size chunk at a time
+        chunk_size = chunk_size or settings.ADD_NEAREST_CHUNK_SIZE
+        for start in range(0, len(timestamp), chunk_size):
+            end = start + chunk_size
+            station_name, distance_km = cls.nearest_station_function()(
+                latitude=latitude[start:end],
+                longitude=longitude[start:end],
+                timestamp=timestamp[start:end]
+            )
+            yield from zip(latitude[start:end], longitude[start:end], timestamp[start:end], station_name, distance_km)
+
+    @staticmethod
+    def add_nearest_station_columns(latitude: np.ndarray, longitude: np.ndarray, timestamp_us: np.ndarray):
+        # Columnar variant of add_nearest_station, see stations/columnar.py.
+        # Always uses the in-memory index, whether or not STATION_INDEX_ENABLED
+        # is set: going through the database would turn every element into a
+        # Python object on the way in and out.
+        return station_index.get_index().add_nearest_station_columns(latitude, longitude, timestamp_us)
@@ -0,0 +1,86 @@
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+# Incremental encoders for annotated add_nearest rows
+# (latitude, longitude, timestamp, station, distance_km)
+
+COLUMNS = ['latitude', 'longitude', 'timestamp', 'station', 'distance_km']
+
+NDJSON = 'application/x-ndjson'
+CSV = 'text/csv'
+
+MEDIA_TYPES = {
+    'ndjson': NDJSON,
+    'csv': CSV,
+}
+
+
+def negotiate(request, format=None):
+    # An explicit ?format= wins over the Accept header; None means the
+    # regular (non-streaming) JSON response
+    if format is not None:
+        return MEDIA_TYPES.get(format.lower())
+    accept = request.headers.get('Accept', '')
+    for media_type in (NDJSON, 'application/ndjson', CSV):
+        if media_type in accept:
+            return CSV if media_type == CSV else NDJSON
+    return None
+
+
+def _row(latitude, longitude, timestamp, station, distance_km):
+    return [latitude, longitude, timestamp.isoformat(), station, distance_km]
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, _row(*row)))) + '\n'
+
+
+class _Echo:
+    # File-like object for csv.writer that hands each line back to the caller
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        latitude, longitude, timestamp, station, distance_km = _row(*row)
+        yield writer.writerow([
+            latitude,
+            longitude,
+            timestamp,
+            station if station is not None else '',
+            distance_km if distance_km is not None else '',
+        ])
+
+
+ENCODERS = {
+    NDJSON: ndjson_lines,
+    CSV: csv_lines,
+}
+
+
+def _take(lines, count):
+    return ''.join(islice(lines, count))
+
+
+async def aiter_lines(lines, batch_size=None):
+    # Under ASGI Django buffers a sync iterator in full before sending
+    # anything. This hands the encoded lines over in batches instead, each
+    # produced in the request's sync thread (where the ORM queries run), so
+    # the first bytes go out after the first chunk is resolved and memory
+    # stays bounded by one batch.
+    batch_size = batch_size or settings.ADD_NEAREST_CHUNK_SIZE
+    take = sync_to_async(_take)
+    while True:
+        part = await take(lines, batch_size)
+        if not part:
+            return
+        yield part
@@ -1,3 +1,365 @@
+import io
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from core.models import Station
+from stations import columnar, index as station_index, parallel
+from stations.kernel import nearest_kernel, sphere_distance
+from stations.services import StationService
+
+
+START = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class AddNearestStreamingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(name='MVCO').set_location(41.325, -70.567, START)
+
+    def body(self, size=3):
+        return {
+            'latitude': [41.3] * size,
+            'longitude': [-70.5] * size,
+            'timestamp': ['2021-01-01T00:00:00Z'] * size,
+        }
+
+    async def test_asgi_streams_asynchronously(self):
+        # A sync iterator would be buffered in full under ASGI
+        response = await self.async_client.post(
+            '/api/stations/add_nearest?format=ndjson', self.body(), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        content = b''.join([part async for part in response.streaming_content])
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row['station'] for row in rows], ['MVCO'] * 3)
+
+    def test_wsgi_streams(self):
+        response = self.client.post(
+            '/api/stations/add_nearest?format=csv', self.body(), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.is_async)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'latitude,longitude,timestamp,station,distance_km')
+        self.assertEqual(len(lines), 4)
+
+
+class StationLocationsQueryCountTests(TestCase):
+    def create_stations(self, count):
+        for i in range(Station.objects.count(), count):
+            station = Station.objects.create(name='S{:03d}'.format(i))
+            # A redeployment, so every station has a closed and an open location
+            station.set_location(41.0, -70.5 - i / 100, START, comment='')
+            station.set_location(41.1, -70.5 - i / 100, START + timedelta(days=30), comment='')
+
+    def test_get_locations_is_one_query(self):
+        timestamp = START + timedelta(days=60)
+        for count in (1, 25):
+            self.create_stations(count)
+            with self.assertNumQueries(1):
+                stations = StationService.compute_stations(timestamp)
+            self.assertEqual(len(stations), count)
+            self.assertEqual(stations[0].station_name, 'S000')
+            self.assertEqual(stations[0].latitude, 41.1)
+
+    def test_stations_now_query_count_is_constant(self):
+        # With the snapshot cache cold: the epoch boundaries and the locations
+        for count in (1, 25):
+            self.create_stations(count)
+            for alias in ('default', 'stations'):
+                caches[alias].clear()
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/stations/now')
+            self.assertEqual(len(response.json()), count)
+
+
+class SphereDistanceTests(TestCase):
+    PAIRS = [
+        ((41.325, -70.567), (41.325, -70.567)),
+        ((41.325, -70.567), (41.326, -70.566)),
+        ((41.0, -70.5), (40.0, -71.0)),
+        ((39.5, -71.5), (41.5, -70.0)),
+        ((0.0, 0.0), (0.0, 90.0)),
+        ((-33.9, 18.4), (35.7, 139.7)),
+        ((89.9, 0.0), (-89.9, 180.0)),
+    ]
+
+    def test_matches_st_distance_sphere(self):
+        with connection.cursor() as cursor:
+            for (lat1, lon1), (lat2, lon2) in self.PAIRS:
+                cursor.execute(
+                    'SELECT ST_DistanceSphere(ST_SetSRID(ST_MakePoint(%s, %s), 4326), '
+                    'ST_SetSRID(ST_MakePoint(%s, %s), 4326))',
+                    [lon1, lat1, lon2, lat2])
+                expected = cursor.fetchone()[0]
+                distance = float(sphere_distance(*np.radians([lat1, lon1, lat2, lon2])))
+                self.assertAlmostEqual(distance, expected, delta=1e-3, msg=((lat1, lon1), (lat2, lon2)))
+
+
+class SetLocationsOverlapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.station = Station.objects.create(name='MVCO')
+        cls.station.set_location(41.325, -70.567, START, end_time=START + timedelta(days=30), comment='')
+
+    def test_batch_rejects_start_inside_closed_location(self):
+        with self.assertRaisesMessage(ValueError, 'MVCO at'):
+            Station.set_locations([
+                (self.station, {'latitude': 41.3, 'longitude': -70.5, 'start_time': START + timedelta(days=10)}),
+            ])
+        self.assertEqual(self.station.locations.count(), 1)
+
+    def test_batch_rejects_overlap_within_batch(self):
+        with self.assertRaises(ValueError):
+            Station.set_locations([
+                (self.station, {'latitude': 41.3, 'longitude': -70.5, 'start_time': START + timedelta(days=40),
+                                'end_time': START + timedelta(days=60)}),
+                (self.station, {'latitude': 41.3, 'longitude': -70.5, 'start_time': START + timedelta(days=50)}),
+            ])
+        self.assertEqual(self.station.locations.count(), 1)
+
+    def test_batch_accepts_start_at_end_time(self):
+        Station.set_locations([
+            (self.station, {'latitude': 41.3, 'longitude': -70.5, 'start_time': START + timedelta(days=30)}),
+        ])
+        self.assertEqual(self.station.locations.count(), 2)
+
+    def test_set_location_rejects_start_inside_closed_location(self):
+        with self.assertRaises(ValueError):
+            self.station.set_location(41.3, -70.5, START + timedelta(days=10))
+
+
+class AddNearestColumnsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(name='MVCO').set_location(41.325, -70.567, START, comment='')
+        Station.objects.create(name='L4').set_location(40.5, -70.9, START, comment='')
+
+    def setUp(self):
+        # Rolling back a test does not signal the index
+        station_index.invalidate()
+
+    def test_npz_matches_json(self):
+        latitude = [41.3, 40.4, 41.0, 40.0]
+        longitude = [-70.5, -70.8, -70.7, -71.0]
+        timestamp = ['2021-01-01T00:00:00Z', '2021-01-01T00:00:00Z', '2019-01-01T00:00:00Z', '2022-06-01T00:00:00Z']
+        expected = self.client.post('/api/stations/add_nearest', {
+            'latitude': latitude, 'longitude': longitude, 'timestamp': timestamp,
+        }, content_type='application/json').json()
+
+        buffer = io.BytesIO()
+        np.savez(buffer, latitude=np.array(latitude), longitude=np.array(longitude),
+                 timestamp=np.array([t.rstrip('Z') for t in timestamp], dtype='datetime64[us]'))
+        response = self.client.post(
+            '/api/stations/add_nearest/npz', buffer.getvalue(), content_type=columnar.MEDIA_TYPE)
+        self.assertEqual(response.status_code, 200)
+        archive = np.load(io.BytesIO(response.content))
+
+        self.assertEqual(archive['station'].tolist(), [name or '' for name in expected['station']])
+        for distance, expected_distance in zip(archive['distance_km'].tolist(), expected['distance_km']):
+            if expected_distance is None:
+                self.assertTrue(np.isnan(distance))
+            else:
+                self.assertAlmostEqual(distance, expected_distance, places=6)
+
+
+class NearestPoolTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(name='MVCO').set_location(41.325, -70.567, START, comment='')
+
+    def tearDown(self):
+        if parallel._pool is not None:
+            parallel._pool.close()
+        parallel._pool = parallel._pool_owner = None
+
+    def nearest(self, index):
+        latitude, longitude = np.array([41.3, 40.4]), np.array([-70.5, -70.8])
+        timestamp = np.full(2, station_index.to_microseconds(START + timedelta(days=1)))
+        location, distance = parallel.get_pool(index, 2).nearest(latitude, longitude, timestamp, 1)
+        expected_location, expected_distance = nearest_kernel(index.arrays, latitude, longitude, timestamp)
+        self.assertEqual(location.tolist(), expected_location.tolist())
+        np.testing.assert_allclose(distance, expected_distance)
+
+    def test_rebuild_keeps_workers_and_releases_old_arrays(self):
+        first = station_index.StationIndex.build()
+        self.nearest(first)
+        pool = parallel._pool
+        executor = pool.executor
+        old_blocks = [block_name for block_name, _, _ in pool.shared.spec.values()]
+
+        Station.objects.create(name='L4').set_location(40.5, -70.9, START, comment='')
+        second = station_index.StationIndex.build()
+        self.nearest(second)
+        self.assertIs(parallel._pool, pool)
+        self.assertIs(pool.executor, executor)
+        # Nothing was using the old generation, so it is gone already
+        for block_name in old_blocks:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=block_name)
+
+
+class ConditionalGetTests(TestCase):
+    URLS = ['/api/stations/now', '/api/stations/at/2021-01-01T00:00:00Z']
+
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(name='MVCO').set_location(41.325, -70.567, START, comment='')
+
+    def setUp(self):
+        for alias in ('default', 'stations'):
+            caches[alias].clear()
+
+    def test_validators_and_not_modified(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag, last_modified = response['ETag'], response['Last-Modified']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, headers={'If-Modified-Since': last_modified})
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_after_write(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.URLS}
+        Station.objects.create(name='L4').set_location(40.5, -70.9, START, comment='')
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                self.assertEqual(len(response.json()), 2)
+
+
+class StationDistancesTests(TestCase):
+    CENTER = (41.0, -70.5)
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(12):
+            # Spread around the center at increasing distances and bearings
+            Station.objects.create(name='S{:02d}'.format(i)).set_location(
+                41.0 + (i - 6) * 0.037, -70.5 + ((i * 5) % 12 - 6) * 0.041, START, comment='')
+        # Not active at the query time
+        Station.objects.create(name='OLD').set_location(41.0, -70.5, START - timedelta(days=30),
+                                                         end_time=START - timedelta(days=1), comment='')
+
+    def exhaustive(self, timestamp):
+        # What distances() used to do: measure every active location and sort
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT station.name, ST_DistanceSphere(location.geolocation, ST_SetSRID(ST_MakePoint(%s, %s), 4326)) '
+                'FROM core_stationlocation AS location JOIN core_station AS station ON station.id = location.station_id '
+                'WHERE location.start_time <= %s AND (location.end_time >= %s OR location.end_time IS NULL) '
+                'ORDER BY 2, 1',
+                [self.CENTER[1], self.CENTER[0], timestamp, timestamp])
+            return cursor.fetchall()
+
+    def distances(self, timestamp, max_distance_km=None):
+        return [
+            (location.station_name, location.distance.m)
+            for location in Station.distances(*self.CENTER, timestamp, max_distance_km=max_distance_km)
+        ]
+
+    def assertSameRows(self, rows, expected):
+        self.assertEqual([name for name, _ in rows], [name for name, _ in expected])
+        for (_, distance), (_, expected_distance) in zip(rows, expected):
+            self.assertAlmostEqual(distance, expected_distance, delta=1e-3)
+
+    def test_ordering_matches_full_sort(self):
+        timestamp = START + timedelta(days=1)
+        expected = self.exhaustive(timestamp)
+        self.assertEqual(len(expected), 12)
+        self.assertSameRows(self.distances(timestamp), expected)
+
+    def test_cutoff_matches_distance_sphere_at_boundary(self):
+        timestamp = START + timedelta(days=1)
+        expected = self.exhaustive(timestamp)
+        for _, boundary in expected[1:-1]:
+            # A centimeter either side of a station's exact distance
+            for cutoff, included in ((boundary + 0.01, True), (boundary - 0.01, False)):
+                with self.subTest(cutoff=cutoff):
+                    rows = self.distances(timestamp, max_distance_km=cutoff / 1000)
+                    self.assertSameRows(rows, [row for row in expected if row[1] <= cutoff])
+                    self.assertEqual(any(abs(distance - boundary) < 1e-3 for _, distance in rows), included)
+
+
+class StationsWithinTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(name='MVCO').set_location(41.0, -70.5, START, comment='')
+        # Moved out of the box after 30 days
+        moved = Station.objects.create(name='L4')
+        moved.set_location(41.2, -70.3, START, comment='')
+        moved.set_location(42.5, -69.0, START + timedelta(days=30), comment='')
+
+    def within(self, **query):
+        response = self.client.post('/api/stations/within', query, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [row['station_name'] for row in response.json()]
+
+    def test_radius(self):
+        timestamp = (START + timedelta(days=1)).isoformat()
+        latitude, longitude = 41.05, -70.45
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT ST_DistanceSphere(ST_SetSRID(ST_MakePoint(%s, %s), 4326), '
+                'ST_SetSRID(ST_MakePoint(%s, %s), 4326))',
+                [longitude, latitude, -70.5, 41.0])
+            distance_km = cursor.fetchone()[0] / 1000
+        inside = self.within(latitude=latitude, longitude=longitude, radius_km=distance_km + 0.01, timestamp=timestamp)
+        self.assertIn('MVCO', inside)
+        outside = self.within(latitude=latitude, longitude=longitude, radius_km=distance_km - 0.01, timestamp=timestamp)
+        self.assertNotIn('MVCO', outside)
+
+    def test_bbox_edges_are_inside(self):
+        timestamp = (START + timedelta(days=1)).isoformat()
+        # MVCO on the west edge, then on the south-west corner
+        self.assertIn('MVCO', self.within(bbox=[-70.5, 40.5, -70.0, 41.5], timestamp=timestamp))
+        self.assertIn('MVCO', self.within(bbox=[-70.5, 41.0, -70.0, 41.5], timestamp=timestamp))
+        self.assertNotIn('MVCO', self.within(bbox=[-70.49, 40.5, -70.0, 41.5], timestamp=timestamp))
+
+    def test_only_active_location_counts(self):
+        bbox = [-71.0, 40.5, -70.0, 41.5]
+        self.assertEqual(self.within(bbox=bbox, timestamp=(START + timedelta(days=10)).isoformat()), ['MVCO', 'L4'])
+        # L4's older location is still inside the box, its active one is not
+        self.assertEqual(self.within(bbox=bbox, timestamp=(START + timedelta(days=60)).isoformat()), ['MVCO'])
+        self.assertEqual(self.within(
+            latitude=41.2, longitude=-70.3, radius_km=1, timestamp=(START + timedelta(days=60)).isoformat()), [])
+
+
+class StationPassesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(name='MVCO').set_location(41.0, -70.5, START, comment='')
+
+    def test_track_leaving_and_reentering_makes_two_passes(self):
+        # Far, in, in, far, in, in, in, far: about 1.1 km per 0.01 degree
+        latitude = [41.2, 41.02, 41.01, 41.1, 41.03, 41.0, 40.98, 40.9]
+        times = [START + timedelta(days=1, hours=hour) for hour in range(len(latitude))]
+        response = self.client.post('/api/stations/passes', {
+            'latitude': latitude,
+            'longitude': [-70.5] * len(latitude),
+            'timestamp': [time.isoformat() for time in times],
+            'radius_km': 5,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        passes = response.json()
+        self.assertEqual(len(passes), 2)
+        for row, (start, end, closest, fixes) in zip(passes, [(1, 2, 2, 2), (4, 6, 5, 3)]):
+            self.assertEqual(row['station_name'], 'MVCO')
+            self.assertEqual(datetime.fromisoformat(row['start_time']), times[start])
+            self.assertEqual(datetime.fromisoformat(row['end_time']), times[end])
+            self.assertEqual(datetime.fromisoformat(row['closest_time']), times[closest])
+            self.assertEqual(row['fixes'], fixes)
+        self.assertAlmostEqual(passes[0]['min_distance_km'], 1.112, places=2)
+        self.assertAlmostEqual(passes[1]['min_distance_km'], 0, places=6)